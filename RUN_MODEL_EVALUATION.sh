@@ -3,10 +3,14 @@ set -e
 
 # Usage: ./RUN_MODEL_EVALUATION.sh <lora_adapter_dir> <base_model_name> <output_merged_dir>
 # Example: ./RUN_MODEL_EVALUATION.sh mistral-7b-optimized "mistralai/Mistral-7B-Instruct-v0.3" merged-mistral-7b-finetuned
+# Set MERGE_MODE=cpu to merge with scripts/merge_lora_streaming.py on a CPU node (no GPU, bounded memory)
+# and MERGE_NODE_SELECTOR=key=value to pick the CPU node pool (it must see the same /mnt/data)
 
 LORA_DIR="${1:-qlora-optimized-qwen25-7b}"
 BASE_MODEL="${2:-Qwen/Qwen2.5-7B-Instruct}"
 MERGED_DIR="${3:-merged-qwen25-7b-finetuned}"
+MERGE_MODE="${MERGE_MODE:-gpu}"
+MERGE_NODE_SELECTOR="${MERGE_NODE_SELECTOR:-library-solution=k8s-training}"
 
 echo "========================================="
 echo "Complete Model Evaluation Pipeline"
@@ -15,6 +19,8 @@ echo ""
 echo "LoRA Adapter: $LORA_DIR"
 echo "Base Model: $BASE_MODEL"
 echo "Output: $MERGED_DIR"
+echo "Merge Mode: $MERGE_MODE"
+[ "$MERGE_MODE" = "cpu" ] && echo "Merge Node Selector: $MERGE_NODE_SELECTOR"
 echo ""
 read -p "Press Enter to continue or Ctrl+C to cancel..."
 echo ""
@@ -55,6 +61,72 @@ else
     sleep 2
     echo ""
 
+if [ "$MERGE_MODE" = "cpu" ]; then
+# Streaming CPU merge: ship the merge tool as a ConfigMap and cache the base model on /mnt/data
+kubectl -n mlflow create configmap merge-lora-script \
+  --from-file=scripts/merge_lora_streaming.py \
+  --dry-run=client -o yaml | kubectl apply -f -
+
+cat > /tmp/merge-job.yaml << EOF
+apiVersion: batch/v1
+kind: Job
+metadata:
+  name: merge-lora-model
+  namespace: mlflow
+spec:
+  template:
+    spec:
+      containers:
+      - name: merge
+        image: python:3.11-slim
+        command:
+        - /bin/bash
+        - -c
+        - |
+          set -ex
+          echo "Installing dependencies..."
+          pip install torch --index-url https://download.pytorch.org/whl/cpu -q
+          pip install safetensors huggingface_hub -q
+          
+          python /opt/merge/merge_lora_streaming.py \
+            --base-model "$BASE_MODEL" \
+            --adapter "/mnt/data/outputs/$LORA_DIR" \
+            --output "/mnt/data/outputs/$MERGED_DIR" \
+            --cache-dir /mnt/data/hf-cache
+          
+          echo "Model size:"
+          du -sh /mnt/data/outputs/$MERGED_DIR
+        volumeMounts:
+        - name: data
+          mountPath: /mnt/data
+        - name: merge-script
+          mountPath: /opt/merge
+        resources:
+          requests:
+            cpu: 4
+            memory: 8Gi
+          limits:
+            cpu: 8
+            memory: 16Gi
+      volumes:
+      - name: data
+        hostPath:
+          path: /mnt/data
+          type: DirectoryOrCreate
+      - name: merge-script
+        configMap:
+          name: merge-lora-script
+      # The job reads and writes /mnt/data via hostPath, so the selected nodes must share that storage
+      nodeSelector:
+        ${MERGE_NODE_SELECTOR%%=*}: "${MERGE_NODE_SELECTOR#*=}"
+      tolerations:
+      - key: nvidia.com/gpu
+        operator: Exists
+        effect: NoSchedule
+      restartPolicy: Never
+  backoffLimit: 2
+EOF
+else
 cat > /tmp/merge-job.yaml << EOF
 apiVersion: batch/v1
 kind: Job
@@ -133,6 +205,7 @@ spec:
       restartPolicy: Never
   backoffLimit: 2
 EOF
+fi
 
 # Delete old merge job if exists
 kubectl delete job merge-lora-model -n mlflow 2>/dev/null || true
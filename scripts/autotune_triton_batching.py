@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Triton Dynamic Batching Autotuner
+Generates candidate max_batch_size / preferred_batch_size / max_queue_delay_microseconds
+settings, loads each one through Triton's explicit model-control API (config override),
+benchmarks it at the target concurrency levels and reports the Pareto-optimal configs
+for throughput against p95 TTFT.
+"""
+
+import os
+import copy
+import json
+import time
+import argparse
+import itertools
+import statistics
+from typing import Dict, List, Optional
+
+import requests
+
+from benchmark_stats import SequentialStopRule
+from benchmark_triton import DEFAULT_PROMPTS, benchmark_concurrency
+
+
+def auto_preferred_sizes(max_batch_size: int) -> List[int]:
+    """Quarter, half and full max_batch_size (the deployment's [8, 16, 32] for 32)"""
+    return sorted({size for size in (max_batch_size // 4, max_batch_size // 2, max_batch_size) if size >= 1})
+
+
+def generate_candidates(max_batch_sizes: List[int], queue_delays_us: List[int], preferred: List[str]) -> List[Dict]:
+    """
+    Cartesian product of batching settings
+    preferred entries are "auto" (see auto_preferred_sizes), "none" (no preferred sizes:
+    batch up to max_batch_size) or an explicit "8/16/32" list.
+    """
+    candidates = []
+    seen = set()
+    for max_batch_size, delay, spec in itertools.product(max_batch_sizes, queue_delays_us, preferred):
+        if spec == "auto":
+            sizes = auto_preferred_sizes(max_batch_size)
+        elif spec == "none":
+            sizes = []
+        else:
+            sizes = sorted(int(s) for s in spec.split("/"))
+        sizes = [s for s in sizes if s <= max_batch_size]
+
+        key = (max_batch_size, delay, tuple(sizes))
+        if key in seen:
+            continue
+        seen.add(key)
+        candidates.append({
+            "max_batch_size": max_batch_size,
+            "preferred_batch_size": sizes,
+            "max_queue_delay_microseconds": delay
+        })
+    return candidates
+
+
+def candidate_from_config(config: Dict) -> Dict:
+    """Batching settings of a loaded model config (Triton may render uint64 fields as strings)"""
+    batching = config.get("dynamic_batching") or {}
+    return {
+        "max_batch_size": int(config.get("max_batch_size", 0)),
+        "preferred_batch_size": [int(s) for s in batching.get("preferred_batch_size", [])],
+        "max_queue_delay_microseconds": int(batching.get("max_queue_delay_microseconds", 0))
+    }
+
+
+def candidate_label(candidate: Dict) -> str:
+    preferred = "/".join(str(s) for s in candidate["preferred_batch_size"]) or "none"
+    return (f"mbs={candidate['max_batch_size']} pref={preferred} "
+            f"delay={candidate['max_queue_delay_microseconds']}us")
+
+
+def apply_candidate(base_config: Dict, candidate: Dict) -> Dict:
+    """Base model config with the candidate's batching settings"""
+    config = copy.deepcopy(base_config)
+    config["max_batch_size"] = candidate["max_batch_size"]
+    batching = dict(config.get("dynamic_batching") or {})
+    batching["max_queue_delay_microseconds"] = candidate["max_queue_delay_microseconds"]
+    if candidate["preferred_batch_size"]:
+        batching["preferred_batch_size"] = candidate["preferred_batch_size"]
+    else:
+        batching.pop("preferred_batch_size", None)
+    config["dynamic_batching"] = batching
+    return config
+
+
+def render_pbtxt(candidate: Dict) -> str:
+    """config.pbtxt lines to paste into the triton-config ConfigMap"""
+    lines = [f"max_batch_size: {candidate['max_batch_size']}", "dynamic_batching {"]
+    if candidate["preferred_batch_size"]:
+        lines.append(f"  preferred_batch_size: [ {', '.join(str(s) for s in candidate['preferred_batch_size'])} ]")
+    lines.append(f"  max_queue_delay_microseconds: {candidate['max_queue_delay_microseconds']}")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def fetch_model_config(triton_url: str, model_name: str) -> Dict:
+    """Current config of the model, loading it first if explicit mode left it unloaded"""
+    response = requests.get(f"{triton_url}/v2/models/{model_name}/config", timeout=30)
+    if response.status_code != 200:
+        load_model(triton_url, model_name)
+        response = requests.get(f"{triton_url}/v2/models/{model_name}/config", timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+def load_model(triton_url: str, model_name: str, config: Optional[Dict] = None, timeout: float = 600):
+    """(Re)load a model through the explicit model-control API, optionally with a config override"""
+    payload = {"parameters": {"config": json.dumps(config)}} if config is not None else {}
+    response = requests.post(f"{triton_url}/v2/repository/models/{model_name}/load", json=payload, timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"Load failed ({response.status_code}): {response.text}")
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if requests.get(f"{triton_url}/v2/models/{model_name}/ready", timeout=10).status_code == 200:
+            return
+        time.sleep(1)
+    raise RuntimeError(f"{model_name} not ready after {timeout:.0f}s")
+
+
+def pareto_front(points: List[Dict]) -> List[Dict]:
+    """Points not dominated on (higher requests_per_second, lower ttft_p95_ms), sorted by throughput"""
+    front = []
+    for p in points:
+        dominated = any(
+            q["requests_per_second"] >= p["requests_per_second"] and q["ttft_p95_ms"] <= p["ttft_p95_ms"] and
+            (q["requests_per_second"] > p["requests_per_second"] or q["ttft_p95_ms"] < p["ttft_p95_ms"])
+            for q in points
+        )
+        if not dominated:
+            front.append(p)
+    return sorted(front, key=lambda p: p["requests_per_second"])
+
+
+def benchmark_candidate(args, config: Dict, concurrency_levels: List[int]) -> Dict:
+    """Load one config and benchmark it at every concurrency level"""
+    load_start = time.time()
+    load_model(args.triton_url, args.model, config, args.load_timeout)
+    load_seconds = time.time() - load_start
+
+    levels = {}
+    for concurrency in concurrency_levels:
+        metrics = benchmark_concurrency(
+            args.triton_url,
+            args.model,
+            concurrency,
+            args.num_requests,
+            DEFAULT_PROMPTS,
+            warmup=args.warmup,
+            stop_rule=SequentialStopRule(args.num_requests),
+            verbose=False
+        )
+        if metrics:
+            levels[concurrency] = {
+                "requests_per_second": metrics["requests_per_second"],
+                "ttft_p95_ms": metrics["ttft"]["p95_ms"],
+                "latency_p95_ms": metrics["latency"]["p95_ms"],
+                "failed_requests": metrics["failed_requests"]
+            }
+    return {"load_seconds": load_seconds, "levels": levels}
+
+
+def summarize(results: List[Dict], concurrency_levels: List[int]) -> Dict:
+    """Pareto fronts per concurrency level and overall (mean throughput vs worst p95 TTFT)"""
+    fronts = {}
+    for concurrency in concurrency_levels:
+        points = [dict(r["levels"][concurrency], label=r["label"]) for r in results if concurrency in r["levels"]]
+        fronts[str(concurrency)] = pareto_front(points)
+
+    overall = []
+    for r in results:
+        if r["levels"] and len(r["levels"]) == len(concurrency_levels):
+            overall.append({
+                "label": r["label"],
+                "requests_per_second": statistics.mean(l["requests_per_second"] for l in r["levels"].values()),
+                "ttft_p95_ms": max(l["ttft_p95_ms"] for l in r["levels"].values())
+            })
+    fronts["overall"] = pareto_front(overall)
+    return fronts
+
+
+def print_results(results: List[Dict], fronts: Dict, concurrency_levels: List[int]):
+    """Print every candidate and the Pareto-optimal ones"""
+    print("\n" + "="*100)
+    print("DYNAMIC BATCHING AUTOTUNE")
+    print("="*100)
+    header = f"{'Config':<40}"
+    for concurrency in concurrency_levels:
+        header += f" {f'c={concurrency} req/s':>13} {'p95 TTFT':>9}"
+    print(header)
+    print("-"*100)
+
+    optimal = {p["label"] for p in fronts["overall"]}
+    for r in results:
+        line = f"{('★ ' if r['label'] in optimal else '  ') + r['label']:<40}"
+        if "error" in r:
+            print(f"{line} {r['error']}")
+            continue
+        for concurrency in concurrency_levels:
+            level = r["levels"].get(concurrency)
+            line += f" {level['requests_per_second']:>13.2f} {level['ttft_p95_ms']:>7.0f}ms" if level else f" {'failed':>23}"
+        print(line)
+    print("="*100)
+
+    for key, front in fronts.items():
+        title = "Overall (mean req/s vs worst p95 TTFT)" if key == "overall" else f"Concurrency {key}"
+        print(f"\n🏆 Pareto front — {title}:")
+        for p in front:
+            print(f"  {p['label']:<40} {p['requests_per_second']:>8.2f} req/s  {p['ttft_p95_ms']:>7.0f}ms p95 TTFT")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Autotune Triton dynamic batching against throughput and p95 TTFT")
+    parser.add_argument("--triton_url", default="http://localhost:8000", help="Triton server URL")
+    parser.add_argument("--model", default="qwen-function-calling", help="Model name")
+    parser.add_argument("--concurrency", default="1,8,16,32", help="Comma-separated target concurrency levels")
+    parser.add_argument("--num_requests", type=int, default=50, help="Measured requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=8, help="Warmup requests per concurrency level")
+    parser.add_argument("--max_batch_sizes", default="16,32,64", help="Comma-separated max_batch_size values")
+    parser.add_argument("--queue_delays_us", default="0,1000,5000,20000,100000",
+                        help="Comma-separated max_queue_delay_microseconds values")
+    parser.add_argument("--preferred_batch_sizes", default="auto,none",
+                        help="Comma-separated preferred_batch_size choices: auto (quarter/half/full max batch), "
+                             "none, or an explicit list such as 8/16/32")
+    parser.add_argument("--load_timeout", type=float, default=600, help="Seconds to wait for each model load")
+    parser.add_argument("--output_file", default="results/triton_autotune.json", help="Output JSON file")
+
+    args = parser.parse_args()
+
+    concurrency_levels = [int(c) for c in args.concurrency.split(",")]
+    candidates = generate_candidates(
+        [int(b) for b in args.max_batch_sizes.split(",")],
+        [int(d) for d in args.queue_delays_us.split(",")],
+        [p.strip() for p in args.preferred_batch_sizes.split(",")]
+    )
+
+    print("="*60)
+    print("Triton Dynamic Batching Autotuner")
+    print("="*60)
+    print(f"Triton URL:      {args.triton_url}")
+    print(f"Model:           {args.model}")
+    print(f"Concurrency:     {args.concurrency}")
+    print(f"Candidates:      {len(candidates)} (+ current config)")
+
+    try:
+        base_config = fetch_model_config(args.triton_url, args.model)
+    except Exception as e:
+        print(f"✗ Cannot read config for {args.model}: {e}")
+        return
+
+    # Benchmark the config the server is running now first, as the baseline
+    baseline = candidate_from_config(base_config)
+    candidates = [baseline] + [c for c in candidates if c != baseline]
+
+    results = []
+    try:
+        for i, candidate in enumerate(candidates, 1):
+            label = candidate_label(candidate)
+            print(f"\n[{i}/{len(candidates)}] {label}{' (current)' if i == 1 else ''}")
+            result = {"label": label, "config": candidate, "current": i == 1}
+            try:
+                result.update(benchmark_candidate(args, apply_candidate(base_config, candidate), concurrency_levels))
+            except Exception as e:
+                print(f"✗ {label}: {e}")
+                result.update({"error": str(e), "levels": {}})
+            results.append(result)
+    finally:
+        # A load without override goes back to config.pbtxt from the model repository
+        print("\nRestoring repository model config...")
+        try:
+            load_model(args.triton_url, args.model, timeout=args.load_timeout)
+            print("✓ Repository config restored")
+        except Exception as e:
+            print(f"⚠ Could not restore original config: {e}")
+
+    fronts = summarize(results, concurrency_levels)
+    print_results(results, fronts, concurrency_levels)
+
+    by_label = {r["label"]: r["config"] for r in results}
+    if fronts["overall"]:
+        print("\nconfig.pbtxt settings for the lowest-latency and highest-throughput Pareto configs:")
+        for p in {fronts["overall"][0]["label"]: None, fronts["overall"][-1]["label"]: None}:
+            print(f"\n# {p}\n{render_pbtxt(by_label[p])}")
+
+    os.makedirs(os.path.dirname(args.output_file) if os.path.dirname(args.output_file) else ".", exist_ok=True)
+    with open(args.output_file, "w") as f:
+        json.dump({
+            "concurrency_levels": concurrency_levels,
+            "num_requests": args.num_requests,
+            "candidates": [dict(r, levels={str(c): m for c, m in r["levels"].items()}) for r in results],
+            "pareto_fronts": fronts,
+            "pareto_pbtxt": {p["label"]: render_pbtxt(by_label[p["label"]]) for p in fronts["overall"]}
+        }, f, indent=2)
+    print(f"\n✓ Results saved to: {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
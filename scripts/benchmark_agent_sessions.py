@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Multi-Turn Agent Session Benchmark
+Runs concurrent agent loops against vLLM: the model emits a function call, a local
+mock fintech tool executes it, and the result is fed back for the next turn.
+Measures end-to-end task time, turns per task and per-turn TTFT as context grows.
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import importlib.util
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+
+from evaluate_bfcl_real import format_functions_for_prompt, extract_json_from_text
+
+
+class MockTool:
+    """A local stand-in for a fintech tool with a BFCL-style definition and simulated latency"""
+
+    def __init__(self, name: str, description: str, parameters: Dict, handler: Callable[[Dict], Dict],
+                 latency_ms: Optional[float] = None):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.handler = handler
+        self.latency_ms = latency_ms
+
+    def definition(self) -> Dict:
+        return {"name": self.name, "description": self.description, "parameters": self.parameters}
+
+
+TOOLS: Dict[str, MockTool] = {}
+
+
+def register_tool(name: str, description: str, properties: Dict, required: List[str] = None,
+                  latency_ms: Optional[float] = None):
+    """Decorator registering a handler as a mock tool; also used by --tools-module plugins"""
+    def decorator(handler: Callable[[Dict], Dict]):
+        parameters = {"type": "dict", "properties": properties, "required": required or []}
+        TOOLS[name] = MockTool(name, description, parameters, handler, latency_ms)
+        return handler
+    return decorator
+
+
+@register_tool("validate_transaction", "Check whether a transaction is valid and not flagged for fraud.",
+               {"transaction_id": {"type": "string", "description": "Transaction identifier, e.g. tx_98765."}},
+               ["transaction_id"])
+def validate_transaction(args: Dict) -> Dict:
+    return {"transaction_id": args.get("transaction_id"), "valid": True, "risk_score": 0.07}
+
+
+@register_tool("process_payment", "Process a payment for the given amount and currency.",
+               {"amount": {"type": "float", "description": "Payment amount."},
+                "currency": {"type": "string", "description": "ISO currency code, e.g. USD."}},
+               ["amount", "currency"])
+def process_payment(args: Dict) -> Dict:
+    return {"status": "completed", "payment_id": f"pay_{random.randint(10000, 99999)}",
+            "amount": args.get("amount"), "currency": args.get("currency")}
+
+
+@register_tool("get_stock_price", "Get the latest price for a stock ticker.",
+               {"ticker": {"type": "string", "description": "Stock ticker symbol, e.g. AAPL."}},
+               ["ticker"])
+def get_stock_price(args: Dict) -> Dict:
+    return {"ticker": args.get("ticker"), "price": 187.42, "currency": "USD"}
+
+
+@register_tool("calculate_tax", "Calculate income tax owed for an income in a US state.",
+               {"income": {"type": "float", "description": "Annual income."},
+                "state": {"type": "string", "description": "Two-letter US state code."}},
+               ["income", "state"])
+def calculate_tax(args: Dict) -> Dict:
+    try:
+        income = float(args.get("income", 0))
+    except (TypeError, ValueError):
+        income = 0.0
+    return {"income": income, "state": args.get("state"), "tax_owed": round(income * 0.24, 2)}
+
+
+@register_tool("create_invoice", "Create an invoice for a customer.",
+               {"customer_id": {"type": "string", "description": "Customer identifier."},
+                "amount": {"type": "float", "description": "Invoice amount."}},
+               ["customer_id", "amount"])
+def create_invoice(args: Dict) -> Dict:
+    return {"invoice_id": f"inv_{random.randint(1000, 9999)}", "customer_id": args.get("customer_id"),
+            "amount": args.get("amount"), "status": "issued"}
+
+
+@register_tool("get_user_info", "Look up account details for a user.",
+               {"user_id": {"type": "string", "description": "User identifier."}},
+               ["user_id"])
+def get_user_info(args: Dict) -> Dict:
+    return {"user_id": args.get("user_id"), "name": "Jane Doe", "tier": "gold", "balance": 12450.18}
+
+
+@register_tool("generate_report", "Generate a transaction report for a date range.",
+               {"date_range": {"type": "string", "description": "Range such as last_30_days."}},
+               ["date_range"])
+def generate_report(args: Dict) -> Dict:
+    return {"date_range": args.get("date_range"), "transactions": 142, "total_volume": 58210.55}
+
+
+# Each task lists the tools a successful agent must call
+TASKS = [
+    {"prompt": "Validate transaction tx_98765 and, if it is valid, process a payment of 299.50 USD.",
+     "required_tools": ["validate_transaction", "process_payment"]},
+    {"prompt": "Look up user 5432, then create an invoice for that customer for 599.99.",
+     "required_tools": ["get_user_info", "create_invoice"]},
+    {"prompt": "Get the AAPL stock price and calculate the tax on an income of 75000 in CA.",
+     "required_tools": ["get_stock_price", "calculate_tax"]},
+    {"prompt": "Generate a report for last_30_days, then validate transaction tx_12345.",
+     "required_tools": ["generate_report", "validate_transaction"]},
+]
+
+
+def load_tools_module(path: str):
+    """
+    Import a plugin module whose register_tool calls add or override mock tools
+    register_tool is injected into the plugin's namespace, so plugins use it without importing.
+    """
+    spec = importlib.util.spec_from_file_location("agent_tools_plugin", path)
+    module = importlib.util.module_from_spec(spec)
+    module.register_tool = register_tool
+    spec.loader.exec_module(module)
+
+
+def build_agent_prompt(task: str, tools: List[MockTool], history: List[Dict]) -> str:
+    """Qwen chat prompt with the tool catalogue, the task and all previous turns"""
+    functions_text = format_functions_for_prompt([t.definition() for t in tools])
+    prompt = f"""<|im_start|>system
+You are a helpful assistant that can call functions. To call a function, respond with only a JSON function call in this format:
+{{"function": "function_name", "param1": value1, "param2": value2}}
+
+Call one function per turn. When the task is complete, respond with a short plain-text summary instead of a function call.
+
+Available functions:
+
+{functions_text}<|im_end|>
+<|im_start|>user
+{task}<|im_end|>
+"""
+    for turn in history:
+        prompt += f"<|im_start|>assistant\n{turn['response']}<|im_end|>\n"
+        prompt += f"<|im_start|>user\nFunction result: {json.dumps(turn['tool_result'])}<|im_end|>\n"
+    return prompt + "<|im_start|>assistant\n"
+
+
+async def chat_turn(session: aiohttp.ClientSession, prompt: str, endpoint: str, model_name: str,
+                    max_tokens: int) -> Dict:
+    """One streaming model turn, returning text, TTFT, latency and token usage"""
+    start_time = time.time()
+    ttft = None
+    chunks = []
+    usage = {}
+
+    async with session.post(
+        f"{endpoint}/v1/completions",
+        json={
+            "model": model_name,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": 0.0,
+            "stop": ["<|im_end|>", "<|endoftext|>"],
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        },
+        timeout=aiohttp.ClientTimeout(total=120)
+    ) as response:
+        response.raise_for_status()
+        async for line in response.content:
+            line = line.strip()
+            if not line.startswith(b"data: ") or line == b"data: [DONE]":
+                continue
+            event = json.loads(line[len(b"data: "):])
+            if event.get("usage"):
+                usage = event["usage"]
+            for choice in event.get("choices", []):
+                if choice.get("text"):
+                    if ttft is None:
+                        ttft = time.time() - start_time
+                    chunks.append(choice["text"])
+
+    latency = time.time() - start_time
+    return {
+        "text": "".join(chunks).strip(),
+        "ttft": ttft if ttft is not None else latency,
+        "latency": latency,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens")
+    }
+
+
+def parse_tool_calls(text: str) -> List[Dict]:
+    """Function calls in a model reply: one object, a list of parallel calls, or none"""
+    parsed = extract_json_from_text(text)
+    candidates = parsed if isinstance(parsed, list) else [parsed]
+    return [c for c in candidates if isinstance(c, dict) and (c.get("function") or c.get("name"))]
+
+
+async def execute_tool(call: Dict, default_latency_ms: float, jitter: float) -> Dict:
+    """Run a parsed call against the matching mock tool after its simulated latency"""
+    name = call.get("function", call.get("name", ""))
+    tool = TOOLS.get(name)
+    if tool is None:
+        return {"error": f"Unknown function: {name}"}
+
+    latency_ms = tool.latency_ms if tool.latency_ms is not None else default_latency_ms
+    await asyncio.sleep(max(latency_ms * (1 + random.uniform(-jitter, jitter)), 0) / 1000)
+
+    args = call.get("parameters", call.get("arguments"))
+    if not isinstance(args, dict):
+        args = {k: v for k, v in call.items() if k not in ("function", "name")}
+    try:
+        return tool.handler(args)
+    except Exception as e:
+        # Plugin tools may raise; hand the failure back to the model like any tool error
+        return {"error": f"{name} failed: {e}"}
+
+
+async def run_session(session: aiohttp.ClientSession, session_id: int, task: Dict, args) -> Dict:
+    """Drive one agent conversation until the model stops calling tools or max turns is hit"""
+    tools = list(TOOLS.values())
+    history = []
+    turns = []
+    called_tools = []
+    tool_errors = 0
+    tool_time = 0.0
+    start_time = time.time()
+    status = "max_turns"
+
+    for turn_index in range(args.max_turns):
+        try:
+            result = await chat_turn(session, build_agent_prompt(task["prompt"], tools, history),
+                                     args.endpoint, args.model, args.max_tokens)
+        except Exception as e:
+            print(f"✗ Session {session_id} turn {turn_index + 1} failed: {e}")
+            status = "error"
+            break
+
+        turns.append({
+            "turn": turn_index + 1,
+            "ttft": result["ttft"],
+            "latency": result["latency"],
+            "prompt_tokens": result["prompt_tokens"],
+            "completion_tokens": result["completion_tokens"]
+        })
+
+        calls = parse_tool_calls(result["text"])
+        if not calls:
+            status = "completed"
+            break
+
+        # Parallel calls (a JSON list) run concurrently, like an agent runtime would
+        tool_start = time.time()
+        tool_results = await asyncio.gather(*[
+            execute_tool(call, args.tool_latency_ms, args.tool_latency_jitter) for call in calls
+        ])
+        tool_time += time.time() - tool_start
+        for call, tool_result in zip(calls, tool_results):
+            called_tools.append(call.get("function", call.get("name")))
+            if isinstance(tool_result, dict) and "error" in tool_result:
+                tool_errors += 1
+        history.append({"response": result["text"],
+                        "tool_result": tool_results[0] if len(tool_results) == 1 else tool_results})
+
+    return {
+        "session_id": session_id,
+        "task": task["prompt"],
+        "status": status,
+        "success": status == "completed" and all(t in called_tools for t in task["required_tools"]),
+        "called_tools": called_tools,
+        "tool_errors": tool_errors,
+        "turns": turns,
+        "total_time": time.time() - start_time,
+        "tool_time": tool_time
+    }
+
+
+async def run_benchmark(args) -> List[Dict]:
+    """Run args.sessions agent sessions with args.concurrent in flight"""
+    semaphore = asyncio.Semaphore(args.concurrent)
+
+    async with aiohttp.ClientSession() as session:
+        async def bounded_session(session_id):
+            async with semaphore:
+                task = TASKS[session_id % len(TASKS)]
+                try:
+                    result = await run_session(session, session_id, task, args)
+                except Exception as e:
+                    # One broken session must not take the whole run down
+                    print(f"✗ Session {session_id} crashed: {e}")
+                    result = {"session_id": session_id, "task": task["prompt"], "status": "error", "success": False,
+                              "called_tools": [], "tool_errors": 0, "turns": [], "total_time": 0.0,
+                              "tool_time": 0.0, "error": str(e)}
+                print(f"{'✓' if result['success'] else '✗'} Session {session_id}: {result['status']}, "
+                      f"{len(result['turns'])} turns, {result['total_time']*1000:.0f}ms")
+                return result
+
+        return await asyncio.gather(*[bounded_session(i) for i in range(args.sessions)])
+
+
+def calculate_metrics(sessions: List[Dict]) -> Dict:
+    """Session-level latency, turns per task, completion rate and per-turn TTFT by turn index"""
+    def pct(values, p):
+        return statistics.quantiles(values, n=100, method="inclusive")[p - 1] if len(values) > 1 else values[0]
+
+    finished = [s for s in sessions if s["status"] != "error"]
+    if not finished:
+        return {"error": "No sessions finished"}
+
+    times = [s["total_time"] for s in finished]
+    by_turn = {}
+    for s in finished:
+        for t in s["turns"]:
+            by_turn.setdefault(t["turn"], []).append(t)
+
+    return {
+        "total_sessions": len(sessions),
+        "errored_sessions": len(sessions) - len(finished),
+        "completed_sessions": sum(1 for s in finished if s["status"] == "completed"),
+        "task_success_rate": sum(1 for s in finished if s["success"]) / len(sessions),
+        "session_time_mean_ms": statistics.mean(times) * 1000,
+        "session_time_p50_ms": pct(times, 50) * 1000,
+        "session_time_p95_ms": pct(times, 95) * 1000,
+        "session_time_p99_ms": pct(times, 99) * 1000,
+        "tool_time_share": sum(s["tool_time"] for s in finished) / sum(times) if sum(times) > 0 else 0,
+        "turns_per_task_mean": statistics.mean(len(s["turns"]) for s in finished),
+        "tool_errors": sum(s["tool_errors"] for s in finished),
+        "sessions_with_tool_errors": sum(1 for s in finished if s["tool_errors"]),
+        "per_turn": {
+            turn: {
+                "samples": len(items),
+                "prompt_tokens_mean": statistics.mean(t["prompt_tokens"] or 0 for t in items),
+                "ttft_p50_ms": pct([t["ttft"] for t in items], 50) * 1000,
+                "ttft_p95_ms": pct([t["ttft"] for t in items], 95) * 1000,
+                "latency_p50_ms": pct([t["latency"] for t in items], 50) * 1000,
+            }
+            for turn, items in sorted(by_turn.items())
+        }
+    }
+
+
+def print_results(metrics: Dict):
+    """Print session-level and per-turn results"""
+    print(f"\n{'='*70}")
+    print("AGENT SESSION BENCHMARK RESULTS")
+    print(f"{'='*70}")
+    print(f"Sessions:          {metrics['total_sessions']} ({metrics['errored_sessions']} errored)")
+    print(f"Completed:         {metrics['completed_sessions']}")
+    print(f"Task success:      {metrics['task_success_rate']*100:.1f}%")
+    print(f"Turns per task:    {metrics['turns_per_task_mean']:.2f}")
+    print(f"Tool errors:       {metrics['tool_errors']} ({metrics['sessions_with_tool_errors']} sessions)")
+    print(f"\n⏱️  End-to-End Task Time:")
+    print(f"  Mean:    {metrics['session_time_mean_ms']:.0f} ms")
+    print(f"  P50:     {metrics['session_time_p50_ms']:.0f} ms")
+    print(f"  P95:     {metrics['session_time_p95_ms']:.0f} ms")
+    print(f"  P99:     {metrics['session_time_p99_ms']:.0f} ms")
+    print(f"  Tool execution share: {metrics['tool_time_share']*100:.1f}%")
+    print(f"\n📊 Per-Turn TTFT (context growth):")
+    print(f"  {'Turn':<6} {'Samples':<9} {'Prompt tok':<12} {'TTFT p50':<10} {'TTFT p95':<10} {'Latency p50':<12}")
+    for turn, stats in metrics["per_turn"].items():
+        print(f"  {turn:<6} {stats['samples']:<9} {stats['prompt_tokens_mean']:<12.0f} {stats['ttft_p50_ms']:<10.0f} "
+              f"{stats['ttft_p95_ms']:<10.0f} {stats['latency_p50_ms']:<12.0f}")
+    print(f"{'='*70}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi-turn agent sessions with mock tools")
+    parser.add_argument("--endpoint", default="http://localhost:8000", help="vLLM endpoint")
+    parser.add_argument("--model", default="/models/merged-qwen25-7b-finetuned", help="Model name/path")
+    parser.add_argument("--sessions", type=int, default=64, help="Total agent sessions")
+    parser.add_argument("--concurrent", type=int, default=16, help="Concurrent sessions")
+    parser.add_argument("--max-turns", type=int, default=6, help="Maximum model turns per session")
+    parser.add_argument("--max-tokens", type=int, default=256, help="Max tokens per model turn")
+    parser.add_argument("--tool-latency-ms", type=float, default=50,
+                        help="Simulated latency for tools that do not set their own")
+    parser.add_argument("--tool-latency-jitter", type=float, default=0.2,
+                        help="Relative +/- jitter applied to tool latency")
+    parser.add_argument("--tools-module", default=None,
+                        help="Python file that registers extra mock tools with register_tool")
+    parser.add_argument("--output", default="results/agent_sessions.json", help="Output file")
+
+    args = parser.parse_args()
+
+    if args.tools_module:
+        load_tools_module(args.tools_module)
+
+    print("="*70)
+    print("Multi-Turn Agent Session Benchmark")
+    print("="*70)
+    print(f"Endpoint:     {args.endpoint}")
+    print(f"Model:        {args.model}")
+    print(f"Sessions:     {args.sessions} ({args.concurrent} concurrent)")
+    print(f"Tools:        {', '.join(TOOLS)}")
+    print(f"Tool latency: {args.tool_latency_ms:.0f}ms ±{args.tool_latency_jitter*100:.0f}%")
+
+    sessions = asyncio.run(run_benchmark(args))
+    metrics = calculate_metrics(sessions)
+
+    if "error" in metrics:
+        print(f"✗ {metrics['error']}")
+        return
+
+    print_results(metrics)
+
+    os.makedirs(os.path.dirname(args.output) if os.path.dirname(args.output) else ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"metrics": metrics, "sessions": sessions}, f, indent=2)
+    print(f"✓ Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Function-Catalogue Encoding Benchmark
+Compares prompt tokens, TTFT and BFCL accuracy across catalogue encodings
+(prose, minified JSON schema, terse signatures, truncated descriptions)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import statistics
+import argparse
+import requests
+from typing import Dict, List, Tuple
+
+from evaluate_bfcl_real import (
+    CATALOG_FORMATTERS,
+    load_bfcl_dataset,
+    build_prompt,
+    format_functions_for_prompt,
+    estimate_tokens,
+    extract_json_from_text,
+    evaluate_response,
+)
+
+
+def parse_encoding(spec: str) -> Tuple[str, int]:
+    """Parse an encoding spec like "signature" or "prose@256" into (format, token_budget)"""
+    catalog_format, _, budget = spec.partition("@")
+    if catalog_format not in CATALOG_FORMATTERS:
+        raise ValueError(f"Unknown catalog format: {catalog_format}")
+    return catalog_format, int(budget) if budget else None
+
+
+def stream_completion(prompt: str, endpoint: str, model_name: str) -> Dict:
+    """Send a streaming completion request, measuring TTFT and collecting usage"""
+    start_time = time.time()
+    ttft = None
+    chunks = []
+    usage = {}
+
+    try:
+        with requests.post(
+            f"{endpoint}/v1/completions",
+            json={
+                "model": model_name,
+                "prompt": prompt,
+                "max_tokens": 512,
+                "temperature": 0.0,
+                "stop": ["<|im_end|>", "<|endoftext|>", "\n\n\n"],
+                "stream": True,
+                "stream_options": {"include_usage": True}
+            },
+            stream=True,
+            timeout=30
+        ) as response:
+            if response.status_code != 200:
+                return {"success": False, "error": f"HTTP {response.status_code}"}
+
+            for line in response.iter_lines():
+                if not line or not line.startswith(b"data: "):
+                    continue
+                data = line[len(b"data: "):]
+                if data == b"[DONE]":
+                    break
+                event = json.loads(data)
+                if event.get("usage"):
+                    usage = event["usage"]
+                for choice in event.get("choices", []):
+                    if choice.get("text"):
+                        if ttft is None:
+                            ttft = time.time() - start_time
+                        chunks.append(choice["text"])
+
+        latency = time.time() - start_time
+        return {
+            "success": True,
+            "text": "".join(chunks).strip(),
+            "ttft": ttft if ttft is not None else latency,
+            "latency": latency,
+            "prompt_tokens": usage.get("prompt_tokens", estimate_tokens(prompt))
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def count_truncated(dataset: List[Dict], catalog_format: str, token_budget: int) -> int:
+    """Samples whose catalogue actually changes under token_budget"""
+    return sum(
+        1 for sample in dataset if sample.get('function') and
+        format_functions_for_prompt(sample['function'], catalog_format, token_budget) !=
+        format_functions_for_prompt(sample['function'], catalog_format)
+    )
+
+
+def benchmark_encoding(dataset: List[Dict], endpoint: str, model_name: str, catalog_format: str, token_budget: int,
+                       run_nonce: int = 0) -> Dict:
+    """Run the dataset with one catalogue encoding and summarize cost and accuracy
+    
+    Each encoding gets its own prompt tag, so it never reuses prefix-cache blocks filled
+    by an earlier encoding with an identical catalogue (which would understate its TTFT).
+    """
+    label = catalog_format + (f"@{token_budget}" if token_budget else "")
+    print(f"\n{'─'*60}")
+    print(f"Encoding: {label}")
+    print(f"{'─'*60}")
+
+    truncated = count_truncated(dataset, catalog_format, token_budget) if token_budget else None
+    if truncated == 0:
+        print(f"⚠ Budget never truncates a catalogue; {label} is identical to {catalog_format}, skipping")
+        return {"encoding": label, "catalog_format": catalog_format, "token_budget": token_budget,
+                "truncated_samples": 0, "skipped": f"identical to {catalog_format}"}
+    if truncated is not None:
+        print(f"Budget truncates {truncated}/{len(dataset)} catalogues")
+
+    ttfts = []
+    prompt_tokens = []
+    correct = 0
+    errors = 0
+
+    for i, sample in enumerate(dataset):
+        question_data = sample.get('question', [[]])[0]
+        question = question_data[0].get('content', '') if question_data else ""
+        functions = sample.get('function', [])
+        if not question or not functions:
+            errors += 1
+            continue
+
+        prompt = build_prompt(question, functions, catalog_format, token_budget, cache_tag=f"{label} {run_nonce}")
+        response = stream_completion(prompt, endpoint, model_name)
+        if not response["success"]:
+            print(f"[{i+1}/{len(dataset)}] ✗ API Error: {response['error']}")
+            errors += 1
+            continue
+
+        ttfts.append(response["ttft"])
+        prompt_tokens.append(response["prompt_tokens"])
+        is_correct, _, _ = evaluate_response(extract_json_from_text(response["text"]), functions, question)
+        correct += is_correct
+        print(f"[{i+1}/{len(dataset)}] {'✓' if is_correct else '✗'} "
+              f"{response['prompt_tokens']} prompt tokens, TTFT {response['ttft']*1000:.0f}ms")
+
+    if not ttfts:
+        return {"encoding": label, "error": "No successful requests"}
+
+    return {
+        "encoding": label,
+        "catalog_format": catalog_format,
+        "token_budget": token_budget,
+        "truncated_samples": truncated,
+        "total": len(dataset),
+        "errors": errors,
+        "accuracy": correct / len(dataset),
+        "prompt_tokens_mean": statistics.mean(prompt_tokens),
+        "prompt_tokens_total": sum(prompt_tokens),
+        "ttft_mean_ms": statistics.mean(ttfts) * 1000,
+        "ttft_median_ms": statistics.median(ttfts) * 1000,
+        "ttft_p95_ms": (statistics.quantiles(ttfts, n=20)[18] if len(ttfts) > 1 else ttfts[0]) * 1000,
+    }
+
+
+def pick_cheapest(summaries: List[Dict], max_accuracy_drop: float) -> Dict:
+    """Pick the encoding with the fewest prompt tokens within max_accuracy_drop of the best accuracy"""
+    valid = [s for s in summaries if "error" not in s and "skipped" not in s]
+    if not valid:
+        return None
+    best_accuracy = max(s["accuracy"] for s in valid)
+    eligible = [s for s in valid if s["accuracy"] >= best_accuracy - max_accuracy_drop]
+    return min(eligible, key=lambda s: s["prompt_tokens_mean"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark function-catalogue encodings")
+    parser.add_argument("--dataset", default="data/bfcl_multiple_parsed.json", help="Path to BFCL dataset")
+    parser.add_argument("--endpoint", default="http://localhost:8000", help="vLLM endpoint")
+    parser.add_argument("--model", default="/models/merged-qwen25-7b-finetuned", help="Model name/path")
+    parser.add_argument("--limit", type=int, default=100, help="Number of samples")
+    parser.add_argument("--encodings", default="prose,json,signature,prose@256,signature@128",
+                        help="Comma-separated encodings; append @N for a description token budget")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0,
+                        help="Accuracy loss (fraction) tolerated when picking the cheapest encoding")
+    parser.add_argument("--output", default="results/catalog_encodings.json", help="Output file")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dataset):
+        print(f"✗ Dataset not found: {args.dataset}")
+        sys.exit(1)
+
+    encodings = [parse_encoding(e.strip()) for e in args.encodings.split(",")]
+
+    print("="*60)
+    print("Function-Catalogue Encoding Benchmark")
+    print("="*60)
+    print(f"Dataset:   {args.dataset}")
+    print(f"Endpoint:  {args.endpoint}")
+    print(f"Model:     {args.model}")
+    print(f"Encodings: {args.encodings}")
+
+    dataset = load_bfcl_dataset(args.dataset, args.limit)
+    run_nonce = random.randint(0, 10**6)
+    summaries = [benchmark_encoding(dataset, args.endpoint, args.model, fmt, budget, run_nonce)
+                 for fmt, budget in encodings]
+    cheapest = pick_cheapest(summaries, args.max_accuracy_drop)
+
+    os.makedirs(os.path.dirname(args.output) if os.path.dirname(args.output) else ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({
+            "dataset": args.dataset,
+            "encodings": summaries,
+            "recommended": cheapest["encoding"] if cheapest else None
+        }, f, indent=2)
+
+    print("\n" + "="*80)
+    print("CATALOGUE ENCODING COMPARISON")
+    print("="*80)
+    print(f"{'Encoding':<20} {'Prompt Tokens':<15} {'TTFT Mean':<12} {'TTFT P95':<12} {'Accuracy':<10} {'Truncated':<10}")
+    print("-"*80)
+    for s in summaries:
+        if "error" in s or "skipped" in s:
+            print(f"{s['encoding']:<20} {s.get('error') or 'skipped: ' + s['skipped']}")
+            continue
+        truncated = "-" if s["truncated_samples"] is None else f"{s['truncated_samples']}/{s['total']}"
+        print(f"{s['encoding']:<20} {s['prompt_tokens_mean']:<15.1f} {s['ttft_mean_ms']:<12.0f} "
+              f"{s['ttft_p95_ms']:<12.0f} {s['accuracy']*100:<10.2f} {truncated:<10}")
+    print("="*80)
+    if cheapest:
+        print(f"\n✓ Cheapest encoding within {args.max_accuracy_drop*100:.1f}% of best accuracy: {cheapest['encoding']}")
+    print(f"✓ Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
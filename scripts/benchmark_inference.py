@@ -3,6 +3,7 @@
 Inference Benchmarking Script
 Measures TTFT (time-to-first-token) and latency for concurrent requests
 Tests 16-32 concurrent requests as required
+Sweep mode characterizes prefill vs decode speed over a prompt/output length grid
 """
 
 import asyncio
@@ -11,28 +12,51 @@ import time
 import json
 import statistics
 import argparse
-from typing import List, Tuple
+import csv
+import random
+from typing import Dict, List, Tuple
 # import mlflow  # Not needed for benchmarking
 import os
 
+from benchmark_stats import SequentialStopRule, steady_state_start, fit_prefill_decode, predict_latency
+from benchmark_trace import TraceWriter
+
 VLLM_ENDPOINT = os.getenv("VLLM_ENDPOINT", "http://vllm-serving.inference.svc.cluster.local:8000/v1")
 
 
+def sse_has_text(line: bytes) -> bool:
+    """Whether a streamed SSE line is a data event carrying choice text (not a separator or [DONE])"""
+    line = line.strip()
+    if not line.startswith(b"data: ") or line == b"data: [DONE]":
+        return False
+    try:
+        event = json.loads(line[len(b"data: "):])
+    except ValueError:
+        return False
+    return any(c.get("text") for c in event.get("choices", []))
+
+
 async def single_request(
     session: aiohttp.ClientSession,
     request_id: int,
     prompt: str,
     endpoint: str,
     model_name: str,
-    stream: bool = True
+    stream: bool = True,
+    trace: TraceWriter = None,
+    slot: int = 0,
+    phase: str = "measure"
 ) -> Tuple[int, float, float, int]:
     """
     Make single inference request and measure metrics
+    If trace is given, the request is written to it as a span on its concurrency slot.
     Returns: (request_id, ttft, latency, tokens_received)
     """
     start_time = time.time()
     ttft = None
     tokens_received = 0
+    first_byte_time = None
+    chunk_times = []
     
     try:
         if stream:
@@ -48,6 +72,7 @@ async def single_request(
                 },
                 timeout=aiohttp.ClientTimeout(total=120)
             ) as response:
+                first_byte_time = time.time()
                 response.raise_for_status()
                 
                 async for line in response.content:
@@ -55,6 +80,8 @@ async def single_request(
                         if ttft is None:
                             ttft = time.time() - start_time
                         tokens_received += 1
+                        if trace and sse_has_text(line):
+                            chunk_times.append(time.time())
                 
         else:
             # Non-streaming request
@@ -68,6 +95,7 @@ async def single_request(
                 },
                 timeout=aiohttp.ClientTimeout(total=120)
             ) as response:
+                first_byte_time = time.time()
                 response.raise_for_status()
                 result = await response.json()
                 ttft = time.time() - start_time  # Approximate for non-streaming
@@ -78,51 +106,115 @@ async def single_request(
         if ttft is None:
             ttft = total_latency
         
+        if trace:
+            trace.request(slot, request_id, 0, start_time, start_time + total_latency, first_byte_time, chunk_times,
+                          {"phase": phase, "ttft_ms": ttft * 1000, "tokens": tokens_received})
+        
         return (request_id, ttft, total_latency, tokens_received)
         
     except Exception as e:
         print(f"✗ Request {request_id} failed: {e}")
+        if trace:
+            trace.request(slot, request_id, 0, start_time, time.time(), first_byte_time, chunk_times,
+                          {"phase": phase, "error": str(e)})
         return (request_id, None, None, 0)
 
 
+async def run_closed_loop(
+    session: aiohttp.ClientSession,
+    concurrent: int,
+    prompt: str,
+    endpoint: str,
+    model_name: str,
+    stream: bool,
+    stop_rule: SequentialStopRule,
+    first_request_id: int = 0,
+    trace: TraceWriter = None,
+    phase: str = "measure"
+) -> List[Tuple[int, float, float, int]]:
+    """
+    Keep `concurrent` requests in flight until the stop rule says to stop
+    Results are returned in send (request ID) order.
+    """
+    results = []
+    issued = 0
+    
+    async def worker(slot):
+        nonlocal issued
+        while stop_rule.should_continue(issued):
+            request_id = first_request_id + issued
+            issued += 1
+            result = await single_request(session, request_id, prompt, endpoint, model_name, stream, trace, slot, phase)
+            stop_rule.record(request_id, result[1], result[2])
+            results.append(result)
+    
+    stop_rule.start()
+    await asyncio.gather(*[worker(slot) for slot in range(concurrent)])
+    return sorted(results, key=lambda r: r[0])
+
+
 async def benchmark(
     endpoint: str,
     model_name: str,
     num_requests: int,
     concurrent: int,
     prompt: str = "What is function calling in AI? Explain how LLMs can call functions.",
-    stream: bool = True
-) -> List[Tuple[int, float, float, int]]:
+    stream: bool = True,
+    warmup: int = 0,
+    stop_rule: SequentialStopRule = None,
+    trace: TraceWriter = None
+) -> Tuple[List[Tuple[int, float, float, int]], float]:
     """
     Run benchmark with specified number of concurrent requests
+    Warmup requests are sent first and excluded from the returned results.
+    If stop_rule is given it decides how many measured requests to send.
+    If trace is given, every request (warmup included) is exported as a trace span.
+    Returns: (results, wall-clock seconds of the measured phase)
     """
+    if stop_rule is None:
+        stop_rule = SequentialStopRule(num_requests)
+    
     print(f"\n{'='*60}")
     print(f"Benchmarking Inference Performance")
     print(f"{'='*60}")
     print(f"Endpoint: {endpoint}")
     print(f"Model: {model_name}")
-    print(f"Total requests: {num_requests}")
+    if stop_rule.target_ci_width is None:
+        print(f"Total requests: {num_requests}")
+    else:
+        print(f"Requests: until p{'/p'.join(map(str, stop_rule.percentiles))} CI width <= "
+              f"{stop_rule.target_ci_width*100:.0f}% (min {num_requests}, max {stop_rule.max_requests}, "
+              f"budget {stop_rule.time_budget}s)")
+    print(f"Warmup requests: {warmup}")
     print(f"Concurrent requests: {concurrent}")
     print(f"Streaming: {stream}")
     print(f"{'='*60}\n")
     
     async with aiohttp.ClientSession() as session:
-        # Create semaphore to limit concurrency
-        semaphore = asyncio.Semaphore(concurrent)
-        
-        async def bounded_request(request_id):
-            async with semaphore:
-                return await single_request(session, request_id, prompt, endpoint, model_name, stream)
+        if warmup:
+            print(f"Warming up with {warmup} requests...")
+            await run_closed_loop(session, concurrent, prompt, endpoint, model_name, stream, SequentialStopRule(warmup),
+                                  trace=trace, phase="warmup")
+            print("✓ Warmup complete\n")
         
-        # Run all requests
-        tasks = [bounded_request(i) for i in range(num_requests)]
-        results = await asyncio.gather(*tasks)
+        start_time = time.time()
+        results = await run_closed_loop(session, concurrent, prompt, endpoint, model_name, stream, stop_rule, warmup,
+                                        trace=trace)
+        total_time = time.time() - start_time
     
-    return results
+    print(f"Stopped after {len(results)} requests: {stop_rule.stop_reason}")
+    return results, total_time
 
 
-def calculate_metrics(results: List[Tuple[int, float, float, int]]) -> dict:
-    """Calculate statistics from results"""
+def calculate_metrics(results: List[Tuple[int, float, float, int]], total_time: float, steady_start: int = 0) -> dict:
+    """Calculate statistics from results
+    
+    Latency statistics cover results[steady_start:]; request throughput counts every
+    successful measured request over total_time, the wall clock of the measured phase.
+    """
+    completed = sum(1 for r in results if r[1] is not None and r[2] is not None)
+    results = results[steady_start:]
+    
     # Filter out failed requests
     valid_results = [r for r in results if r[1] is not None and r[2] is not None]
     
@@ -156,7 +248,8 @@ def calculate_metrics(results: List[Tuple[int, float, float, int]]) -> dict:
         
         # Throughput
         "tokens_per_second_mean": statistics.mean([t / l for t, l in zip(tokens, latency_values) if l > 0]),
-        "requests_per_second": len(valid_results) / max(latency_values) if latency_values else 0,
+        "requests_per_second": completed / total_time if total_time > 0 else 0,
+        "total_time_seconds": total_time,
     }
     
     return metrics
@@ -189,6 +282,15 @@ def print_results(metrics: dict):
     print(f"  Tokens/sec: {metrics['tokens_per_second_mean']:.2f}")
     print(f"  Requests/sec: {metrics['requests_per_second']:.2f}")
     
+    if "stopping" in metrics:
+        print(f"\n🛑 Stopping:")
+        print(f"  Warmup excluded: {metrics['warmup_requests']} requests")
+        print(f"  Steady-state trim: {metrics['steady_state_trimmed_requests']} requests")
+        print(f"  Reason: {metrics['stopping']['stop_reason']}")
+        if metrics['stopping']['target_ci_width'] is not None:
+            for name, width in metrics['stopping']['ci_relative_widths'].items():
+                print(f"  {name} CI width: {'n/a' if width is None else f'{width*100:.1f}%'}")
+    
     # Check against targets
     print(f"\n✅ Performance Targets:")
     ttft_ok = metrics['ttft_mean'] < 0.5
@@ -199,6 +301,200 @@ def print_results(metrics: dict):
     print(f"{'='*60}\n")
 
 
+# Common single-token English words used to build prompts of a known length
+SYNTHETIC_WORDS = (
+    "the account balance payment transfer amount date user bank card fee rate "
+    "loan credit debit report budget tax income invoice order price stock market"
+).split()
+
+
+def build_synthetic_prompt(target_tokens: int, nonce: int) -> str:
+    """
+    Build a prompt of roughly target_tokens tokens (~1 token per word)
+    The leading nonce makes every prompt unique so prefix caching cannot skip prefill.
+    """
+    words = [SYNTHETIC_WORDS[(nonce + i) % len(SYNTHETIC_WORDS)] for i in range(max(target_tokens - 8, 1))]
+    return f"Request {nonce}: " + " ".join(words)
+
+
+async def sweep_request(
+    session: aiohttp.ClientSession,
+    prompt: str,
+    max_tokens: int,
+    endpoint: str,
+    model_name: str
+) -> Dict:
+    """Streaming request that forces max_tokens output and reports server-side token usage"""
+    start_time = time.time()
+    ttft = None
+    usage = {}
+    
+    try:
+        async with session.post(
+            f"{endpoint}/v1/completions",
+            json={
+                "model": model_name,
+                "prompt": prompt,
+                "max_tokens": max_tokens,
+                "temperature": 0.0,
+                "ignore_eos": True,
+                "stream": True,
+                "stream_options": {"include_usage": True}
+            },
+            timeout=aiohttp.ClientTimeout(total=300)
+        ) as response:
+            response.raise_for_status()
+            
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b"data: ") or line == b"data: [DONE]":
+                    continue
+                event = json.loads(line[len(b"data: "):])
+                if event.get("usage"):
+                    usage = event["usage"]
+                if ttft is None and any(c.get("text") for c in event.get("choices", [])):
+                    ttft = time.time() - start_time
+        
+        latency = time.time() - start_time
+        return {
+            "ttft": ttft if ttft is not None else latency,
+            "latency": latency,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens", max_tokens)
+        }
+    except Exception as e:
+        print(f"✗ Sweep request failed: {e}")
+        return None
+
+
+async def run_sweep(
+    endpoint: str,
+    model_name: str,
+    input_lengths: List[int],
+    output_lengths: List[int],
+    concurrency_levels: List[int],
+    requests_per_cell: int = None,
+    max_model_len: int = 4096,
+    warmup: int = 0
+) -> List[Dict]:
+    """
+    Run every (concurrency, input length, output length) cell of the grid
+    Warmup requests are sent first and discarded.
+    Returns one entry per cell with its per-request samples.
+    """
+    cells = []
+    nonce = random.randint(0, 10**6)
+    
+    async with aiohttp.ClientSession() as session:
+        if warmup:
+            print(f"Warming up with {warmup} requests...")
+            await asyncio.gather(*[
+                sweep_request(session, build_synthetic_prompt(input_lengths[0], nonce - i - 1), output_lengths[0],
+                              endpoint, model_name)
+                for i in range(warmup)
+            ])
+            print("✓ Warmup complete\n")
+        
+        for concurrent in concurrency_levels:
+            semaphore = asyncio.Semaphore(concurrent)
+            # Enough requests to keep every slot busy at least twice
+            cell_requests = requests_per_cell or 2 * concurrent
+            
+            for input_len in input_lengths:
+                for output_len in output_lengths:
+                    if input_len + output_len > max_model_len:
+                        continue
+                    
+                    async def bounded_request(i):
+                        async with semaphore:
+                            prompt = build_synthetic_prompt(input_len, nonce + i)
+                            return await sweep_request(session, prompt, output_len, endpoint, model_name)
+                    
+                    results = await asyncio.gather(*[bounded_request(i) for i in range(cell_requests)])
+                    nonce += cell_requests
+                    samples = [r for r in results if r is not None]
+                    for sample in samples:
+                        if sample["prompt_tokens"] is None:
+                            sample["prompt_tokens"] = input_len
+                    
+                    cells.append({
+                        "concurrency": concurrent,
+                        "input_tokens": input_len,
+                        "output_tokens": output_len,
+                        "requests": cell_requests,
+                        "samples": samples
+                    })
+                    print(f"✓ concurrency={concurrent:<3} input={input_len:<5} output={output_len:<5} "
+                          f"{len(samples)}/{cell_requests} ok")
+    
+    return cells
+
+
+def summarize_sweep(cells: List[Dict]) -> Tuple[List[Dict], Dict[int, Dict]]:
+    """Build the heatmap table (one row per cell) and per-concurrency prefill/decode fits"""
+    def pct(values, p):
+        return statistics.quantiles(values, n=100, method="inclusive")[p - 1] if len(values) > 1 else values[0]
+    
+    rows = []
+    for cell in cells:
+        samples = cell["samples"]
+        if not samples:
+            continue
+        ttfts = [s["ttft"] for s in samples]
+        latencies = [s["latency"] for s in samples]
+        decode_times = [(s["latency"] - s["ttft"]) / max(s["completion_tokens"] - 1, 1) for s in samples]
+        rows.append({
+            "concurrency": cell["concurrency"],
+            "input_tokens": cell["input_tokens"],
+            "output_tokens": cell["output_tokens"],
+            "successful_requests": len(samples),
+            "prompt_tokens_mean": statistics.mean(s["prompt_tokens"] for s in samples),
+            "completion_tokens_mean": statistics.mean(s["completion_tokens"] for s in samples),
+            "ttft_p50_ms": pct(ttfts, 50) * 1000,
+            "ttft_p95_ms": pct(ttfts, 95) * 1000,
+            "latency_p50_ms": pct(latencies, 50) * 1000,
+            "latency_p95_ms": pct(latencies, 95) * 1000,
+            "tpot_mean_ms": statistics.mean(decode_times) * 1000,
+        })
+    
+    fits = {}
+    for concurrent in sorted({c["concurrency"] for c in cells}):
+        samples = [s for c in cells if c["concurrency"] == concurrent for s in c["samples"]]
+        if not samples:
+            continue
+        fit = fit_prefill_decode(samples)
+        fit["latency_mean_abs_pct_error"] = None
+        # A one-point input or output axis leaves that slope unfitted, so there is no model to score
+        if fit["prefill_seconds_per_token"] is not None and fit["decode_seconds_per_token"] is not None:
+            errors = [abs(predict_latency(fit, s["prompt_tokens"], s["completion_tokens"])[1] - s["latency"]) / s["latency"]
+                      for s in samples]
+            fit["latency_mean_abs_pct_error"] = statistics.mean(errors) * 100
+        fit["aggregate_decode_tokens_per_second"] = (
+            fit["decode_tokens_per_second"] * concurrent if fit["decode_tokens_per_second"] else None
+        )
+        fits[concurrent] = fit
+    
+    return rows, fits
+
+
+def print_sweep_results(fits: Dict[int, Dict]):
+    """Print prefill/decode fits per concurrency level"""
+    def fmt(value, spec):
+        return "n/a" if value is None else format(value, spec)
+    
+    print(f"\n{'='*80}")
+    print("PREFILL / DECODE CHARACTERIZATION")
+    print(f"{'='*80}")
+    print(f"{'Concurrency':<13} {'Prefill tok/s':<15} {'Prefill ovh ms':<16} {'Decode tok/s':<14} "
+          f"{'Aggr decode':<13} {'Fit err %':<10}")
+    print("-"*80)
+    for concurrent, fit in fits.items():
+        print(f"{concurrent:<13} {fmt(fit['prefill_tokens_per_second'], '.0f'):<15} "
+              f"{fit['prefill_overhead_s']*1000:<16.1f} {fmt(fit['decode_tokens_per_second'], '.1f'):<14} "
+              f"{fmt(fit['aggregate_decode_tokens_per_second'], '.0f'):<13} {fmt(fit['latency_mean_abs_pct_error'], '.1f'):<10}")
+    print(f"{'='*80}\n")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Benchmark inference performance")
     parser.add_argument(
@@ -239,33 +535,169 @@ def main():
         default="/models/merged-qwen25-7b-finetuned",
         help="Model name/path for inference"
     )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=0,
+        help="Warmup requests sent before measuring (excluded from metrics)"
+    )
+    parser.add_argument(
+        "--detect-steady-state",
+        action="store_true",
+        help="Drop leading measurements until latency reaches steady state (MSER-5)"
+    )
+    parser.add_argument(
+        "--target-ci-width",
+        type=float,
+        default=None,
+        help="Keep sending requests until the p95/p99 TTFT and latency CIs are narrower than this "
+             "fraction of the estimate (--requests becomes the minimum)"
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=600,
+        help="Maximum seconds to spend when --target-ci-width is set"
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=5000,
+        help="Maximum requests to send when --target-ci-width is set"
+    )
+    
+    parser.add_argument(
+        "--trace-file",
+        default=None,
+        help="Write every request as a span to this Chrome trace-event / Perfetto JSON file"
+    )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="Run a prefill/decode characterization sweep over the length grid below"
+    )
+    parser.add_argument(
+        "--input-lengths",
+        default="128,512,1024,2048,3500",
+        help="Comma-separated prompt lengths (tokens) for --sweep"
+    )
+    parser.add_argument(
+        "--output-lengths",
+        default="16,64,256",
+        help="Comma-separated output lengths (tokens) for --sweep"
+    )
+    parser.add_argument(
+        "--sweep-concurrency",
+        default="1,8,16,32",
+        help="Comma-separated concurrency levels for --sweep"
+    )
+    parser.add_argument(
+        "--sweep-requests",
+        type=int,
+        default=None,
+        help="Requests per sweep cell (default: 2x the concurrency level)"
+    )
+    parser.add_argument(
+        "--max-model-len",
+        type=int,
+        default=4096,
+        help="Skip sweep cells whose input + output exceed the server's context length"
+    )
     
     args = parser.parse_args()
     
+    if args.sweep and args.trace_file:
+        parser.error("--trace-file is not supported with --sweep")
+    
+    if args.sweep:
+        input_lengths = [int(x) for x in args.input_lengths.split(",")]
+        output_lengths = [int(x) for x in args.output_lengths.split(",")]
+        if len(set(input_lengths)) < 2 or len(set(output_lengths)) < 2:
+            print("⚠ A single input or output length leaves its per-token cost unfitted (reported as n/a)")
+        cells = asyncio.run(
+            run_sweep(
+                args.endpoint,
+                args.model,
+                input_lengths,
+                output_lengths,
+                [int(x) for x in args.sweep_concurrency.split(",")],
+                args.sweep_requests,
+                args.max_model_len,
+                args.warmup
+            )
+        )
+        rows, fits = summarize_sweep(cells)
+        if not rows:
+            print("✗ No successful requests")
+            return
+        print_sweep_results(fits)
+        
+        results_file = f"sweep_results_{args.model_version}.json"
+        with open(results_file, "w") as f:
+            json.dump({"cells": rows, "fits": fits}, f, indent=2)
+        
+        # Long-format table: pivot on (input_tokens, output_tokens) per concurrency for heatmaps
+        table_file = f"sweep_results_{args.model_version}.csv"
+        with open(table_file, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        
+        print(f"✓ Sweep results saved to {results_file}")
+        print(f"✓ Heatmap table saved to {table_file}")
+        return
+    
     # Setup MLflow
     # mlflow_uri = os.getenv("MLFLOW_TRACKING_URI", "http://mlflow-server.mlflow.svc.cluster.local:5000")
     # mlflow.set_tracking_uri(mlflow_uri)
     # mlflow.set_experiment("inference-benchmarking")
     
+    stop_rule = SequentialStopRule(
+        args.requests,
+        target_ci_width=args.target_ci_width,
+        time_budget=args.time_budget,
+        max_requests=args.max_requests,
+        detect_steady_state=args.detect_steady_state
+    )
+    
+    trace = TraceWriter(args.trace_file, "vllm") if args.trace_file else None
+    
     # Run benchmark
-    results = asyncio.run(
-        benchmark(
-            args.endpoint,
-            args.model,
-            args.requests,
-            args.concurrent,
-            args.prompt,
-            stream=not args.no_stream
+    try:
+        results, total_time = asyncio.run(
+            benchmark(
+                args.endpoint,
+                args.model,
+                args.requests,
+                args.concurrent,
+                args.prompt,
+                stream=not args.no_stream,
+                warmup=args.warmup,
+                stop_rule=stop_rule,
+                trace=trace
+            )
         )
-    )
+    finally:
+        if trace:
+            trace.close()
+            print(f"✓ Trace written to {args.trace_file} (open in ui.perfetto.dev or chrome://tracing)")
+    
+    # Drop the transient before steady state
+    steady_start = steady_state_start([r[2] for r in results]) if args.detect_steady_state else 0
+    if steady_start:
+        print(f"Steady state detected after {steady_start} requests; excluding them from metrics")
     
     # Calculate metrics
-    metrics = calculate_metrics(results)
+    metrics = calculate_metrics(results, total_time, steady_start)
     
     if "error" in metrics:
         print(f"✗ {metrics['error']}")
         return
     
+    metrics["warmup_requests"] = args.warmup
+    metrics["steady_state_trimmed_requests"] = steady_start
+    metrics["stopping"] = stop_rule.summary()
+    
     # Print results
     print_results(metrics)
     
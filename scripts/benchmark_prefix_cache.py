@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Prefix-Cache Effectiveness Benchmark
+Generates workloads with a controlled shared-prefix ratio and number of distinct
+prefixes, then measures TTFT and throughput against vLLM's prefix-cache hit rate
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import statistics
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from benchmark_inference import build_synthetic_prompt, sweep_request
+from evaluate_bfcl_real import load_bfcl_dataset, build_prompt
+
+# vLLM V1 exposes token counters; older engines only a hit-rate gauge
+PREFIX_CACHE_QUERIES = "vllm:prefix_cache_queries_total"
+PREFIX_CACHE_HITS = "vllm:prefix_cache_hits_total"
+PREFIX_CACHE_HIT_RATE = "vllm:gpu_prefix_cache_hit_rate"
+
+
+def build_synthetic_workload(num_requests: int, prompt_tokens: int, shared_ratio: float, num_prefixes: int,
+                             nonce: int) -> List[str]:
+    """
+    Prompts of ~prompt_tokens tokens whose first shared_ratio share comes from one of
+    num_prefixes prefixes (round-robin) and whose remainder is unique per request
+    """
+    prefix_tokens = int(prompt_tokens * shared_ratio)
+    prefixes = [build_synthetic_prompt(prefix_tokens, nonce + p) for p in range(num_prefixes)] if prefix_tokens else []
+
+    prompts = []
+    for i in range(num_requests):
+        suffix = build_synthetic_prompt(prompt_tokens - prefix_tokens, nonce + num_prefixes + i)
+        prompts.append(f"{prefixes[i % num_prefixes]}\n{suffix}" if prefixes else suffix)
+    return prompts
+
+
+def build_catalog_workload(dataset: List[Dict], num_requests: int, num_prefixes: int, nonce: int) -> List[str]:
+    """
+    Realistic prompts: system prompt plus one of num_prefixes BFCL function catalogues,
+    followed by a unique user question. A workload tag ahead of the system prompt keeps
+    the prefixes distinct from every other workload's.
+    """
+    questions = [s['question'][0][0]['content'] for s in dataset if s.get('question') and s['question'][0]]
+    prompts = []
+    for i in range(num_requests):
+        functions = dataset[i % num_prefixes]['function']
+        prompt = build_prompt(f"{questions[i % len(questions)]} (request {i})", functions)
+        prompts.append(f"[workload {nonce}]\n{prompt}")
+    return prompts
+
+
+def shared_prefix_ratio(prompts: List[str]) -> float:
+    """Mean share of each prompt (in characters) that precedes the user request"""
+    ratios = [p.index("User request:") / len(p) for p in prompts if "User request:" in p]
+    return statistics.mean(ratios) if ratios else 0
+
+
+def expected_hit_rate(num_requests: int, num_prefixes: int, shared_ratio: float) -> float:
+    """Ideal prompt-token hit rate: every prefix misses once, then always hits"""
+    if num_requests == 0:
+        return 0
+    return shared_ratio * max(num_requests - num_prefixes, 0) / num_requests
+
+
+async def fetch_prefix_cache_counters(session: aiohttp.ClientSession, endpoint: str) -> Optional[Dict]:
+    """Read prefix-cache counters from vLLM's Prometheus /metrics endpoint, if available"""
+    try:
+        async with session.get(f"{endpoint}/metrics", timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.status != 200:
+                return None
+            text = await response.text()
+    except Exception:
+        return None
+
+    counters = {}
+    for line in text.splitlines():
+        if line.startswith("#") or not line.strip():
+            continue
+        name, _, value = line.rpartition(" ")
+        name = name.split("{", 1)[0]
+        if name in (PREFIX_CACHE_QUERIES, PREFIX_CACHE_HITS, PREFIX_CACHE_HIT_RATE):
+            counters[name] = counters.get(name, 0) + float(value)
+    return counters or None
+
+
+def server_hit_rate(before: Optional[Dict], after: Optional[Dict]) -> Optional[float]:
+    """
+    Prefix-cache hit rate over a workload from counter deltas
+    Older vLLM only exposes a hit-rate gauge over the engine's whole history, which says
+    nothing about a single workload, so None is returned there.
+    """
+    if not after or not before or PREFIX_CACHE_QUERIES not in after:
+        return None
+    queries = after[PREFIX_CACHE_QUERIES] - before.get(PREFIX_CACHE_QUERIES, 0)
+    hits = after.get(PREFIX_CACHE_HITS, 0) - before.get(PREFIX_CACHE_HITS, 0)
+    return hits / queries if queries > 0 else None
+
+
+async def run_workload(session: aiohttp.ClientSession, endpoint: str, model_name: str, prompts: List[str],
+                       concurrent: int, max_tokens: int) -> Dict:
+    """Send a workload's prompts with bounded concurrency and summarize TTFT, throughput and cache hits"""
+    # Best effort: only available when vLLM runs with VLLM_SERVER_DEV_MODE=1
+    try:
+        async with session.post(f"{endpoint}/reset_prefix_cache", timeout=aiohttp.ClientTimeout(total=10)):
+            pass
+    except Exception:
+        pass
+
+    before = await fetch_prefix_cache_counters(session, endpoint)
+    semaphore = asyncio.Semaphore(concurrent)
+
+    async def bounded_request(prompt):
+        async with semaphore:
+            return await sweep_request(session, prompt, max_tokens, endpoint, model_name)
+
+    start_time = time.time()
+    results = await asyncio.gather(*[bounded_request(p) for p in prompts])
+    wall_time = time.time() - start_time
+    after = await fetch_prefix_cache_counters(session, endpoint)
+
+    samples = [r for r in results if r is not None]
+    if not samples:
+        return {"error": "No successful requests"}
+
+    ttfts = [s["ttft"] for s in samples]
+    return {
+        "successful_requests": len(samples),
+        "failed_requests": len(results) - len(samples),
+        "prompt_tokens_mean": statistics.mean(s["prompt_tokens"] or 0 for s in samples),
+        "ttft_mean_ms": statistics.mean(ttfts) * 1000,
+        "ttft_median_ms": statistics.median(ttfts) * 1000,
+        "ttft_p95_ms": (statistics.quantiles(ttfts, n=20)[18] if len(ttfts) > 1 else ttfts[0]) * 1000,
+        "requests_per_second": len(samples) / wall_time,
+        "output_tokens_per_second": sum(s["completion_tokens"] for s in samples) / wall_time,
+        "server_hit_rate": server_hit_rate(before, after),
+        # Engine-lifetime gauge (older vLLM); not specific to this workload
+        "server_hit_rate_cumulative": after.get(PREFIX_CACHE_HIT_RATE) if after else None,
+    }
+
+
+async def run_benchmark(args) -> List[Dict]:
+    """Run every synthetic (shared ratio, prefix count) workload plus the optional catalogue workload"""
+    ratios = [float(r) for r in args.shared_ratios.split(",")]
+    prefix_counts = [int(n) for n in args.num_prefixes.split(",")]
+    nonce = random.randint(0, 10**6)
+    workloads = []
+
+    async with aiohttp.ClientSession() as session:
+        if await fetch_prefix_cache_counters(session, args.endpoint) is None:
+            print("⚠ No prefix-cache metrics at /metrics; reporting expected hit rates only")
+
+        if args.warmup:
+            print(f"Warming up with {args.warmup} requests...")
+            await run_workload(session, args.endpoint, args.model,
+                               build_synthetic_workload(args.warmup, args.prompt_tokens, 0, 1, nonce),
+                               args.concurrent, args.max_tokens)
+            nonce += args.warmup + 1
+            print("✓ Warmup complete")
+
+        for num_prefixes in prefix_counts:
+            for ratio in ratios:
+                # Fresh nonces per workload so earlier workloads never pre-warm the cache
+                prompts = build_synthetic_workload(args.requests, args.prompt_tokens, ratio, num_prefixes, nonce)
+                nonce += num_prefixes + args.requests
+
+                summary = await run_workload(session, args.endpoint, args.model, prompts, args.concurrent,
+                                             args.max_tokens)
+                summary.update({
+                    "workload": "synthetic",
+                    "shared_ratio": ratio,
+                    "num_prefixes": num_prefixes,
+                    "expected_hit_rate": expected_hit_rate(args.requests, num_prefixes, ratio),
+                })
+                workloads.append(summary)
+                print(f"✓ shared={ratio:<5} prefixes={num_prefixes:<4} "
+                      f"TTFT p50 {summary.get('ttft_median_ms', float('nan')):.0f}ms")
+
+        if args.catalog_dataset:
+            dataset = load_bfcl_dataset(args.catalog_dataset, limit=10**6)
+            for num_prefixes in prefix_counts:
+                prompts = build_catalog_workload(dataset, args.requests, num_prefixes, nonce)
+                nonce += 1
+                ratio = shared_prefix_ratio(prompts)
+                summary = await run_workload(session, args.endpoint, args.model, prompts, args.concurrent,
+                                             args.max_tokens)
+                summary.update({
+                    "workload": "catalog",
+                    "shared_ratio": ratio,
+                    "num_prefixes": num_prefixes,
+                    "expected_hit_rate": expected_hit_rate(args.requests, num_prefixes, ratio),
+                })
+                workloads.append(summary)
+                print(f"✓ catalog prefixes={num_prefixes:<4} "
+                      f"TTFT p50 {summary.get('ttft_median_ms', float('nan')):.0f}ms")
+
+    return workloads
+
+
+def print_results(workloads: List[Dict]):
+    """Print TTFT and throughput against shared-prefix ratio and hit rate"""
+    def fmt_rate(rate):
+        return "n/a" if rate is None else f"{rate*100:.1f}%"
+
+    print("\n" + "="*100)
+    print("PREFIX-CACHE EFFECTIVENESS")
+    print("="*100)
+    print(f"{'Workload':<10} {'Shared':<8} {'Prefixes':<9} {'Exp. hit':<9} {'Server hit':<11} "
+          f"{'TTFT mean':<11} {'TTFT p95':<10} {'Req/s':<8} {'Out tok/s':<10}")
+    print("-"*100)
+    for w in workloads:
+        if "error" in w:
+            print(f"{w['workload']:<10} {w['shared_ratio']:<8.2f} {w['num_prefixes']:<9} {w['error']}")
+            continue
+        print(f"{w['workload']:<10} {w['shared_ratio']:<8.2f} {w['num_prefixes']:<9} "
+              f"{fmt_rate(w['expected_hit_rate']):<9} {fmt_rate(w['server_hit_rate']):<11} "
+              f"{w['ttft_mean_ms']:<11.0f} {w['ttft_p95_ms']:<10.0f} {w['requests_per_second']:<8.2f} "
+              f"{w['output_tokens_per_second']:<10.0f}")
+    print("="*100)
+
+    if any(w.get("server_hit_rate") is None and w.get("server_hit_rate_cumulative") is not None for w in workloads):
+        print("⚠ Server exposes only the cumulative vllm:gpu_prefix_cache_hit_rate gauge; per-workload hit rates are "
+              "n/a (see server_hit_rate_cumulative in the results file)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vLLM prefix-cache effectiveness")
+    parser.add_argument("--endpoint", default="http://localhost:8000", help="vLLM endpoint")
+    parser.add_argument("--model", default="/models/merged-qwen25-7b-finetuned", help="Model name/path")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per workload")
+    parser.add_argument("--concurrent", type=int, default=16, help="Concurrent requests")
+    parser.add_argument("--prompt-tokens", type=int, default=2048, help="Synthetic prompt length (tokens)")
+    parser.add_argument("--max-tokens", type=int, default=32, help="Output tokens per request")
+    parser.add_argument("--warmup", type=int, default=16, help="Unique-prompt warmup requests sent before measuring")
+    parser.add_argument("--shared-ratios", default="0,0.25,0.5,0.75,0.9",
+                        help="Comma-separated shares of each prompt taken from a shared prefix")
+    parser.add_argument("--num-prefixes", default="1,4,16", help="Comma-separated counts of distinct prefixes")
+    parser.add_argument("--catalog-dataset", default=None,
+                        help="Also run a system prompt + BFCL function catalogue workload from this dataset")
+    parser.add_argument("--output", default="results/prefix_cache_benchmark.json", help="Output file")
+
+    args = parser.parse_args()
+
+    print("="*60)
+    print("Prefix-Cache Effectiveness Benchmark")
+    print("="*60)
+    print(f"Endpoint:       {args.endpoint}")
+    print(f"Model:          {args.model}")
+    print(f"Requests:       {args.requests} per workload, {args.concurrent} concurrent")
+    print(f"Shared ratios:  {args.shared_ratios}")
+    print(f"Prefix counts:  {args.num_prefixes}")
+
+    workloads = asyncio.run(run_benchmark(args))
+    print_results(workloads)
+
+    os.makedirs(os.path.dirname(args.output) if os.path.dirname(args.output) else ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"prompt_tokens": args.prompt_tokens, "max_tokens": args.max_tokens, "workloads": workloads},
+                  f, indent=2)
+    print(f"\n✓ Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
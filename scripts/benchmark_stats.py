@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Benchmark Statistics Helpers
+Warmup (steady-state) detection, sequential stopping rules and latency-model
+fitting shared by the vLLM and Triton benchmark scripts
+"""
+
+import math
+import time
+import statistics
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+def steady_state_start(values: Sequence[Optional[float]], batch_size: int = 5) -> int:
+    """
+    Find where steady state begins using the MSER-5 truncation heuristic
+    Values must be in send order; None entries (failed requests) are ignored.
+    Returns the index into values of the first steady-state observation.
+    """
+    positions = [i for i, v in enumerate(values) if v is not None]
+    observed = [values[i] for i in positions]
+
+    # Average into batches to smooth per-request noise
+    batches = [
+        statistics.mean(observed[i:i + batch_size])
+        for i in range(0, len(observed) - batch_size + 1, batch_size)
+    ]
+    if len(batches) < 4:
+        return 0
+
+    best_d, best_score = 0, math.inf
+    # Never discard more than half the run
+    for d in range(len(batches) // 2 + 1):
+        tail = batches[d:]
+        mean = statistics.mean(tail)
+        score = sum((b - mean) ** 2 for b in tail) / len(tail) ** 2
+        if score < best_score:
+            best_d, best_score = d, score
+
+    return positions[best_d * batch_size] if best_d else 0
+
+
+def quantile_ci(values: Sequence[float], q: float, confidence: float = 0.95) -> Tuple[float, float, float]:
+    """
+    Distribution-free confidence interval for a quantile using order statistics
+    Returns (estimate, lower, upper); bounds are inf when there are too few samples.
+    """
+    ordered = sorted(values)
+    n = len(ordered)
+    if n == 0:
+        return math.nan, -math.inf, math.inf
+
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    estimate = ordered[min(n - 1, max(0, math.ceil(n * q) - 1))]
+    spread = z * math.sqrt(n * q * (1 - q))
+    lower_rank = math.floor(n * q - spread)
+    upper_rank = math.ceil(n * q + spread)
+
+    lower = ordered[lower_rank - 1] if lower_rank >= 1 else -math.inf
+    upper = ordered[upper_rank - 1] if upper_rank <= n else math.inf
+    return estimate, lower, upper
+
+
+def relative_ci_width(values: Sequence[float], q: float, confidence: float = 0.95) -> float:
+    """Width of the quantile confidence interval relative to the estimate"""
+    estimate, lower, upper = quantile_ci(values, q, confidence)
+    if not values or estimate <= 0 or math.isinf(lower) or math.isinf(upper):
+        return math.inf
+    return (upper - lower) / estimate
+
+
+class SequentialStopRule:
+    """
+    Decides when a closed-loop benchmark has collected enough measurements
+    Without a target CI width it simply stops after min_requests. With one, it
+    keeps going until every tracked percentile of TTFT and latency has a
+    relative CI narrower than the target, or a time/request budget runs out.
+    """
+
+    def __init__(
+        self,
+        min_requests: int,
+        target_ci_width: Optional[float] = None,
+        time_budget: Optional[float] = None,
+        max_requests: Optional[int] = None,
+        percentiles: Sequence[int] = (95, 99),
+        confidence: float = 0.95,
+        detect_steady_state: bool = False
+    ):
+        self.min_requests = min_requests
+        self.target_ci_width = target_ci_width
+        self.time_budget = time_budget
+        self.max_requests = max_requests
+        self.percentiles = percentiles
+        self.confidence = confidence
+        self.detect_steady_state = detect_steady_state
+        self.samples: List[Tuple[int, Optional[float], Optional[float]]] = []
+        self.stop_reason = None
+        self.start_time = None
+        self._widths: Dict[str, float] = {}
+        self._widths_at = -1
+
+    def start(self):
+        self.start_time = time.time()
+
+    def record(self, request_id: int, ttft: Optional[float], latency: Optional[float]):
+        """Record one completed request (None values for failures)"""
+        self.samples.append((request_id, ttft, latency))
+
+    def ci_widths(self) -> Dict[str, float]:
+        """Relative CI width for each tracked percentile of TTFT and latency"""
+        if self._widths_at == len(self.samples):
+            return self._widths
+
+        # Steady-state detection needs send order, not completion order
+        ordered = sorted(self.samples)
+        start = steady_state_start([s[2] for s in ordered]) if self.detect_steady_state else 0
+        widths = {}
+        for name, column in [("ttft", 1), ("latency", 2)]:
+            values = [s[column] for s in ordered[start:] if s[column] is not None]
+            for p in self.percentiles:
+                widths[f"{name}_p{p}"] = relative_ci_width(values, p / 100, self.confidence)
+
+        self._widths, self._widths_at = widths, len(self.samples)
+        return widths
+
+    def should_continue(self, issued: int) -> bool:
+        """Whether another request should be sent, given how many were already issued"""
+        if self.stop_reason:
+            return False
+
+        if self.target_ci_width is None:
+            if issued >= self.min_requests:
+                self.stop_reason = "request count reached"
+        elif self.time_budget is not None and time.time() - self.start_time >= self.time_budget:
+            self.stop_reason = "time budget exhausted"
+        elif self.max_requests is not None and issued >= self.max_requests:
+            self.stop_reason = "max requests reached"
+        elif len(self.samples) >= self.min_requests and \
+                all(w <= self.target_ci_width for w in self.ci_widths().values()):
+            self.stop_reason = "confidence intervals converged"
+
+        return self.stop_reason is None
+
+    def summary(self) -> Dict:
+        """Stopping details for inclusion in the results file"""
+        return {
+            "stop_reason": self.stop_reason,
+            "target_ci_width": self.target_ci_width,
+            "confidence": self.confidence,
+            "elapsed_seconds": time.time() - self.start_time if self.start_time else 0,
+            "ci_relative_widths": {k: (None if math.isinf(v) else v) for k, v in self.ci_widths().items()}
+        }
+
+
+def fit_prefill_decode(samples: Sequence[Dict]) -> Dict:
+    """
+    Fit a linear prefill/decode latency model to per-request measurements
+    Each sample needs prompt_tokens, completion_tokens, ttft and latency (seconds).
+    TTFT ~ prefill_overhead + prompt_tokens / prefill_tps
+    latency - TTFT ~ decode_overhead + (completion_tokens - 1) / decode_tps
+    A slope is None when its token counts take a single value (a one-point grid axis).
+    """
+    def fit(x: List[float], y: List[float]) -> Tuple[Optional[float], float]:
+        try:
+            slope, intercept = statistics.linear_regression(x, y)
+        except statistics.StatisticsError:
+            # Not enough distinct x values to fit a slope; keep the mean as the overhead
+            return None, statistics.mean(y)
+        return slope, intercept
+
+    prefill_slope, prefill_overhead = fit(
+        [s["prompt_tokens"] for s in samples],
+        [s["ttft"] for s in samples]
+    )
+    decode_slope, decode_overhead = fit(
+        [s["completion_tokens"] - 1 for s in samples],
+        [s["latency"] - s["ttft"] for s in samples]
+    )
+
+    return {
+        "samples": len(samples),
+        "prefill_overhead_s": prefill_overhead,
+        "prefill_seconds_per_token": prefill_slope,
+        "prefill_tokens_per_second": 1 / prefill_slope if prefill_slope and prefill_slope > 0 else None,
+        "decode_overhead_s": decode_overhead,
+        "decode_seconds_per_token": decode_slope,
+        "decode_tokens_per_second": 1 / decode_slope if decode_slope and decode_slope > 0 else None,
+    }
+
+
+def predict_latency(model: Dict, prompt_tokens: int, completion_tokens: int) -> Tuple[float, float]:
+    """Predict (TTFT, end-to-end latency) in seconds from a fit_prefill_decode model"""
+    if model["prefill_seconds_per_token"] is None or model["decode_seconds_per_token"] is None:
+        raise ValueError("prefill/decode model has an unfitted slope; sweep more than one length per axis")
+    ttft = model["prefill_overhead_s"] + prompt_tokens * model["prefill_seconds_per_token"]
+    decode = model["decode_overhead_s"] + max(completion_tokens - 1, 0) * model["decode_seconds_per_token"]
+    return ttft, ttft + decode
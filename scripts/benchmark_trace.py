@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark Trace Export
+Writes every benchmark request as a span in Chrome trace-event JSON (loadable in
+chrome://tracing and ui.perfetto.dev). Events are appended as each request
+finishes, so long runs never hold the trace in memory; the JSON array format
+tolerates a missing closing bracket if a run is interrupted.
+"""
+
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional
+
+
+class TraceWriter:
+    """Incremental Chrome trace-event writer; one thread (row) per concurrency slot"""
+
+    def __init__(self, path: str, backend: str):
+        os.makedirs(os.path.dirname(path) if os.path.dirname(path) else ".", exist_ok=True)
+        self.path = path
+        self.backend = backend
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.named_slots = set()
+        self.file = open(path, "w")
+        self.file.write("[\n")
+        self.first_event = True
+        self._write([{"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": backend}}])
+
+    def _us(self, timestamp: float) -> float:
+        return (timestamp - self.start_time) * 1e6
+
+    def _write(self, events: List[Dict]):
+        with self.lock:
+            for event in events:
+                self.file.write(("" if self.first_event else ",\n") + json.dumps(event, separators=(",", ":")))
+                self.first_event = False
+            self.file.flush()
+
+    def request(
+        self,
+        slot: int,
+        request_id: int,
+        prompt_id: int,
+        send_time: float,
+        end_time: float,
+        first_byte_time: Optional[float] = None,
+        chunk_times: List[float] = (),
+        args: Dict = None
+    ):
+        """Emit one request as a span with send, first-byte, per-chunk and completion events"""
+        events = []
+        if slot not in self.named_slots:
+            self.named_slots.add(slot)
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": slot, "args": {"name": f"slot {slot}"}})
+
+        span_args = {"request_id": request_id, "prompt_id": prompt_id, "backend": self.backend, "slot": slot}
+        span_args.update(args or {})
+        events.append({
+            "name": f"request {request_id}",
+            "cat": self.backend,
+            "ph": "X",
+            "pid": 1,
+            "tid": slot,
+            "ts": self._us(send_time),
+            "dur": (end_time - send_time) * 1e6,
+            "args": span_args
+        })
+
+        marks = [("send", send_time)]
+        if first_byte_time is not None:
+            marks.append(("first_byte", first_byte_time))
+        marks += [("chunk", t) for t in chunk_times]
+        marks.append(("complete", end_time))
+        for name, timestamp in marks:
+            events.append({
+                "name": name,
+                "cat": self.backend,
+                "ph": "i",
+                "s": "t",
+                "pid": 1,
+                "tid": slot,
+                "ts": self._us(timestamp),
+                "args": {"request_id": request_id}
+            })
+
+        self._write(events)
+
+    def close(self):
+        with self.lock:
+            self.file.write("\n]\n")
+            self.file.close()
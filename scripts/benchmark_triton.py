@@ -8,26 +8,46 @@ import argparse
 import time
 import json
 import statistics
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import numpy as np
 
+from benchmark_stats import SequentialStopRule, steady_state_start
+from benchmark_trace import TraceWriter
+
+# Test prompts for function calling
+DEFAULT_PROMPTS = [
+    "Call the get_weather function for San Francisco",
+    "Execute get_stock_price for AAPL ticker",
+    "Call send_email with recipient john@example.com and subject 'Meeting'",
+    "Run calculate_tax for income 75000 and state CA",
+    "Execute create_invoice with customer_id 12345 and amount 599.99",
+    "Call search_database for query 'recent transactions'",
+    "Run validate_transaction with transaction_id tx_98765",
+    "Execute get_user_info for user_id 5432",
+    "Call process_payment with amount 299.50 and currency USD",
+    "Run generate_report for date_range last_30_days"
+]
+
+
 def send_inference_request(triton_url, model_name, prompt, max_tokens=100, request_id=0):
     """Send inference request to Triton"""
     start_time = time.time()
     
-    # Triton HTTP/REST API format
+    # Triton HTTP/REST API format; names and shapes follow the triton-config ConfigMap
+    # (max_batch_size > 0, so each input has a leading batch dimension)
     payload = {
         "inputs": [
             {
-                "name": "prompt",
-                "shape": [1],
+                "name": "text_input",
+                "shape": [1, 1],
                 "datatype": "BYTES",
                 "data": [prompt]
             },
             {
                 "name": "max_tokens",
-                "shape": [1],
+                "shape": [1, 1],
                 "datatype": "INT32",
                 "data": [max_tokens]
             }
@@ -73,40 +93,96 @@ def send_inference_request(triton_url, model_name, prompt, max_tokens=100, reque
             "request_id": request_id
         }
 
-def benchmark_concurrency(triton_url, model_name, concurrency, num_requests, prompts):
-    """Benchmark at a specific concurrency level"""
+def run_closed_loop(triton_url, model_name, concurrency, prompts, stop_rule, verbose=True, trace=None,
+                    trace_args=None):
+    """Keep `concurrency` requests in flight until the stop rule says to stop; results are in send order
+    
+    If trace is given, each request is written to it as a span on its concurrency slot.
+    """
+    results = []
+    issued = 0
+    lock = threading.Lock()
+    
+    def worker(slot):
+        nonlocal issued
+        while True:
+            with lock:
+                if not stop_rule.should_continue(issued):
+                    return
+                request_id = issued
+                issued += 1
+            
+            prompt_id = request_id % len(prompts)
+            send_time = time.time()
+            result = send_inference_request(triton_url, model_name, prompts[prompt_id], 100, request_id)
+            
+            if trace:
+                # Non-streaming: the first byte arrives with the complete response
+                end_time = send_time + result["latency_ms"] / 1000
+                args = dict(trace_args or {}, success=result["success"])
+                if not result["success"]:
+                    args["error"] = result.get("error")
+                trace.request(slot, request_id, prompt_id, send_time, end_time, end_time, args=args)
+            
+            with lock:
+                ok = result["success"]
+                stop_rule.record(request_id, result["ttft_ms"] / 1000 if ok else None,
+                                 result["latency_ms"] / 1000 if ok else None)
+                results.append(result)
+            
+            if verbose:
+                if ok:
+                    print(f"✓ Request {result['request_id']}: {result['latency_ms']:.0f}ms")
+                else:
+                    print(f"✗ Request {result['request_id']}: {result.get('error', 'Unknown error')}")
+    
+    stop_rule.start()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker, slot) for slot in range(concurrency)]:
+            future.result()
+    
+    return sorted(results, key=lambda r: r["request_id"])
+
+
+def benchmark_concurrency(triton_url, model_name, concurrency, num_requests, prompts, warmup=0, stop_rule=None,
+                          detect_steady_state=False, trace=None, verbose=True):
+    """Benchmark at a specific concurrency level
+    
+    Warmup requests are excluded from metrics. If stop_rule is given it decides how many
+    measured requests to send; otherwise exactly num_requests are sent. If trace is given,
+    every request (warmup included) is exported as a span tagged with the concurrency level.
+    verbose=False suppresses per-request lines.
+    """
     print(f"\n{'='*60}")
     print(f"Benchmarking with {concurrency} concurrent requests")
     print(f"{'='*60}")
     
-    results = []
-    start_time = time.time()
+    if stop_rule is None:
+        stop_rule = SequentialStopRule(num_requests)
     
-    with ThreadPoolExecutor(max_workers=concurrency) as executor:
-        futures = []
-        for i in range(num_requests):
-            prompt = prompts[i % len(prompts)]
-            future = executor.submit(
-                send_inference_request,
-                triton_url,
-                model_name,
-                prompt,
-                100,
-                i
-            )
-            futures.append(future)
-        
-        # Collect results
-        for future in as_completed(futures):
-            result = future.result()
-            results.append(result)
-            if result["success"]:
-                print(f"✓ Request {result['request_id']}: {result['latency_ms']:.0f}ms")
-            else:
-                print(f"✗ Request {result['request_id']}: {result.get('error', 'Unknown error')}")
+    if warmup:
+        print(f"Warming up with {warmup} requests...")
+        run_closed_loop(triton_url, model_name, concurrency, prompts, SequentialStopRule(warmup), verbose=False,
+                        trace=trace, trace_args={"concurrency": concurrency, "phase": "warmup"})
+        print("✓ Warmup complete")
     
+    start_time = time.time()
+    results = run_closed_loop(triton_url, model_name, concurrency, prompts, stop_rule, verbose, trace=trace,
+                              trace_args={"concurrency": concurrency, "phase": "measure"})
     end_time = time.time()
     total_time = end_time - start_time
+    print(f"Stopped after {len(results)} requests: {stop_rule.stop_reason}")
+    
+    # Throughput covers the whole measured phase, so count before trimming
+    measured_successful = [r for r in results if r["success"]]
+    
+    # Drop the transient before steady state
+    steady_start = 0
+    if detect_steady_state:
+        steady_start = steady_state_start([r["latency_ms"] if r["success"] else None for r in results])
+        if steady_start:
+            print(f"Steady state detected after {steady_start} requests; excluding them from metrics")
+    results = results[steady_start:]
     
     # Calculate metrics
     successful = [r for r in results if r["success"]]
@@ -118,16 +194,18 @@ def benchmark_concurrency(triton_url, model_name, concurrency, num_requests, pro
     
     latencies = [r["latency_ms"] for r in successful]
     ttfts = [r["ttft_ms"] for r in successful]
-    total_tokens = sum(r.get("tokens", 0) for r in successful)
     
     metrics = {
         "concurrency": concurrency,
-        "total_requests": num_requests,
+        "total_requests": len(results),
+        "warmup_requests": warmup,
+        "steady_state_trimmed_requests": steady_start,
+        "stopping": stop_rule.summary(),
         "successful_requests": len(successful),
         "failed_requests": len(failed),
         "total_time_seconds": total_time,
-        "requests_per_second": len(successful) / total_time,
-        "tokens_per_second": total_tokens / total_time,
+        "requests_per_second": len(measured_successful) / total_time,
+        "tokens_per_second": sum(r.get("tokens", 0) for r in measured_successful) / total_time,
         "latency": {
             "min_ms": min(latencies),
             "max_ms": max(latencies),
@@ -174,6 +252,10 @@ def benchmark_concurrency(triton_url, model_name, concurrency, num_requests, pro
     print(f"    Mean:             {metrics['ttft']['mean_ms']:.0f}ms")
     print(f"    Median (P50):     {metrics['ttft']['p50_ms']:.0f}ms")
     print(f"    P95:              {metrics['ttft']['p95_ms']:.0f}ms")
+    print(f"\n  Stopping:           {metrics['stopping']['stop_reason']}")
+    if metrics['stopping']['target_ci_width'] is not None:
+        for name, width in metrics['stopping']['ci_relative_widths'].items():
+            print(f"    {name + ' CI width:':<18} {'n/a' if width is None else f'{width*100:.1f}%'}")
     
     return metrics
 
@@ -184,22 +266,20 @@ def main():
     parser.add_argument("--concurrency", default="1,8,16,24,32", help="Comma-separated concurrency levels")
     parser.add_argument("--num_requests", type=int, default=100, help="Number of requests per concurrency")
     parser.add_argument("--output_file", default="results/triton_performance.json", help="Output JSON file")
+    parser.add_argument("--warmup", type=int, default=0, help="Warmup requests per concurrency (excluded from metrics)")
+    parser.add_argument("--detect_steady_state", action="store_true",
+                        help="Drop leading measurements until latency reaches steady state (MSER-5)")
+    parser.add_argument("--target_ci_width", type=float, default=None,
+                        help="Keep sending requests until p95/p99 TTFT and latency CIs are narrower than this "
+                             "fraction of the estimate (--num_requests becomes the minimum)")
+    parser.add_argument("--time_budget", type=float, default=600, help="Max seconds per concurrency with --target_ci_width")
+    parser.add_argument("--max_requests", type=int, default=5000, help="Max requests per concurrency with --target_ci_width")
+    parser.add_argument("--trace_file", default=None,
+                        help="Write every request as a span to this Chrome trace-event / Perfetto JSON file")
     
     args = parser.parse_args()
     
-    # Test prompts for function calling
-    prompts = [
-        "Call the get_weather function for San Francisco",
-        "Execute get_stock_price for AAPL ticker",
-        "Call send_email with recipient john@example.com and subject 'Meeting'",
-        "Run calculate_tax for income 75000 and state CA",
-        "Execute create_invoice with customer_id 12345 and amount 599.99",
-        "Call search_database for query 'recent transactions'",
-        "Run validate_transaction with transaction_id tx_98765",
-        "Execute get_user_info for user_id 5432",
-        "Call process_payment with amount 299.50 and currency USD",
-        "Run generate_report for date_range last_30_days"
-    ]
+    prompts = DEFAULT_PROMPTS
     
     print("="*60)
     print("Triton Inference Server Performance Benchmark")
@@ -224,19 +304,36 @@ def main():
     # Parse concurrency levels
     concurrency_levels = [int(c.strip()) for c in args.concurrency.split(",")]
     
+    trace = TraceWriter(args.trace_file, "triton") if args.trace_file else None
+    
     # Run benchmarks
     all_results = {}
     for concurrency in concurrency_levels:
+        stop_rule = SequentialStopRule(
+            args.num_requests,
+            target_ci_width=args.target_ci_width,
+            time_budget=args.time_budget,
+            max_requests=args.max_requests,
+            detect_steady_state=args.detect_steady_state
+        )
         metrics = benchmark_concurrency(
             args.triton_url,
             args.model,
             concurrency,
             args.num_requests,
-            prompts
+            prompts,
+            warmup=args.warmup,
+            stop_rule=stop_rule,
+            detect_steady_state=args.detect_steady_state,
+            trace=trace
         )
         if metrics:
             all_results[f"concurrency_{concurrency}"] = metrics
     
+    if trace:
+        trace.close()
+        print(f"\n✓ Trace written to {args.trace_file} (open in ui.perfetto.dev or chrome://tracing)")
+    
     # Save results
     import os
     os.makedirs(os.path.dirname(args.output_file) if os.path.dirname(args.output_file) else ".", exist_ok=True)
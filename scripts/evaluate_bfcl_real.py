@@ -11,6 +11,8 @@ import time
 import requests
 import argparse
 import re
+import random
+import statistics
 from typing import Dict, List, Tuple, Any
 
 def load_bfcl_dataset(filepath: str, limit: int = 100) -> List[Dict]:
@@ -25,8 +27,8 @@ def load_bfcl_dataset(filepath: str, limit: int = 100) -> List[Dict]:
     return data
 
 
-def format_functions_for_prompt(functions: List[Dict]) -> str:
-    """Format function definitions for the prompt"""
+def format_functions_prose(functions: List[Dict]) -> str:
+    """Format function definitions as prose, one line per parameter"""
     formatted = []
     for func in functions:
         params_desc = []
@@ -44,14 +46,200 @@ def format_functions_for_prompt(functions: List[Dict]) -> str:
     return "\n\n".join(formatted)
 
 
-def call_vllm_inference(question: str, functions: List[Dict], endpoint: str, model_name: str) -> Dict:
-    """Call vLLM inference with proper formatting for Qwen model"""
+def format_functions_json(functions: List[Dict]) -> str:
+    """Format function definitions as minified JSON schema, one function per line"""
+    return "\n".join(json.dumps(func, separators=(',', ':')) for func in functions)
+
+
+def format_functions_signature(functions: List[Dict]) -> str:
+    """Format function definitions as terse signatures, dropping parameter descriptions"""
+    formatted = []
+    for func in functions:
+        parameters = func.get('parameters', {})
+        required = parameters.get('required', [])
+        args = []
+        for param_name, param_info in parameters.get('properties', {}).items():
+            if 'enum' in param_info:
+                param_type = "|".join(json.dumps(v) for v in param_info['enum'])
+            else:
+                param_type = param_info.get('type', 'any')
+                if 'items' in param_info:
+                    param_type += f"[{param_info['items'].get('type', 'any')}]"
+            arg = f"{param_name}{'' if param_name in required else '?'}: {param_type}"
+            if 'default' in param_info:
+                arg += f"={json.dumps(param_info['default'])}"
+            args.append(arg)
+        
+        func_str = f"{func['name']}({', '.join(args)})"
+        if func.get('description'):
+            func_str += f" # {func['description']}"
+        formatted.append(func_str)
+    
+    return "\n".join(formatted)
+
+
+CATALOG_FORMATTERS = {
+    "prose": format_functions_prose,
+    "json": format_functions_json,
+    "signature": format_functions_signature,
+}
+
+# Word caps tried in order when a catalogue exceeds its token budget
+DESCRIPTION_WORD_CAPS = [24, 16, 8, 4, 0]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) used for budgeting"""
+    return (len(text) + 3) // 4
+
+
+def truncate_descriptions(functions: List[Dict], max_words: int) -> List[Dict]:
+    """Return a copy of the functions with every description cut to max_words words"""
+    def truncate(text: str) -> str:
+        words = text.split()
+        return text if len(words) <= max_words else " ".join(words[:max_words])
+    
+    def truncate_param(param_info: Dict) -> Dict:
+        param_info = dict(param_info)
+        if 'description' in param_info:
+            param_info['description'] = truncate(param_info['description'])
+            if not param_info['description']:
+                del param_info['description']
+        if 'properties' in param_info:
+            param_info['properties'] = {k: truncate_param(v) for k, v in param_info['properties'].items()}
+        return param_info
+    
+    truncated = []
+    for func in functions:
+        func = dict(func)
+        if 'description' in func:
+            func['description'] = truncate(func['description'])
+        if 'parameters' in func:
+            func['parameters'] = truncate_param(func['parameters'])
+        truncated.append(func)
+    return truncated
+
+
+def format_functions_for_prompt(functions: List[Dict], catalog_format: str = "prose", token_budget: int = None) -> str:
+    """Format function definitions for the prompt
+    
+    If token_budget is set, descriptions are progressively truncated until the
+    estimated size of the catalogue fits (or descriptions are gone entirely).
+    """
+    formatter = CATALOG_FORMATTERS[catalog_format]
+    text = formatter(functions)
+    if token_budget is None:
+        return text
+    
+    for max_words in DESCRIPTION_WORD_CAPS:
+        if estimate_tokens(text) <= token_budget:
+            break
+        text = formatter(truncate_descriptions(functions, max_words))
+    return text
+
+
+# BFCL uses Python-flavoured type names; map them onto JSON schema types
+BFCL_TO_JSON_SCHEMA_TYPES = {
+    "dict": "object",
+    "float": "number",
+    "tuple": "array",
+    "integer": "integer",
+    "string": "string",
+    "boolean": "boolean",
+    "array": "array",
+}
+
+
+def convert_param_schema(param_info: Dict) -> Dict:
+    """Convert a BFCL parameter definition into a JSON schema fragment"""
+    schema = {}
+    param_type = param_info.get('type', 'any')
+    if param_type in BFCL_TO_JSON_SCHEMA_TYPES:
+        schema["type"] = BFCL_TO_JSON_SCHEMA_TYPES[param_type]
+    
+    if 'enum' in param_info:
+        schema["enum"] = param_info['enum']
+    if 'items' in param_info:
+        schema["items"] = convert_param_schema(param_info['items'])
+    if 'properties' in param_info:
+        schema["properties"] = {
+            name: convert_param_schema(info) for name, info in param_info['properties'].items()
+        }
+        required = unique_required(param_info.get('required', []), schema["properties"])
+        if required:
+            schema["required"] = required
+    
+    return schema
+
+
+def unique_required(required: List[str], properties: Dict) -> List[str]:
+    """Required names that exist in properties, without duplicates (JSON schema requires unique items)"""
+    return list(dict.fromkeys(p for p in required if p in properties))
+
+
+# Parameter names that clash with the keys of the flat call format (evaluate_response
+# reads the function name from "function"/"name" and nested params from "parameters"/"arguments")
+RESERVED_CALL_KEYS = {"function", "name", "parameters", "arguments"}
+
+
+def build_guided_json_schema(functions: List[Dict]) -> Dict:
+    """Build a JSON schema matching the {"function": name, ...params} call format
+    
+    Functions with a parameter named like a call key (e.g. BFCL's `function` argument
+    of calculate_derivative or `name` of museum.get_hours) use the nested {"function": name, "parameters": {...}}
+    shape instead, so the name stays constrained; evaluate_response accepts both.
+    """
+    variants = []
+    for func in functions:
+        parameters = func.get('parameters', {})
+        param_properties = {
+            param_name: convert_param_schema(param_info)
+            for param_name, param_info in parameters.get('properties', {}).items()
+        }
+        param_required = unique_required(parameters.get('required', []), param_properties)
+        function_schema = {"type": "string", "enum": [func['name']]}
+        
+        if RESERVED_CALL_KEYS & set(param_properties):
+            variants.append({
+                "type": "object",
+                "properties": {
+                    "function": function_schema,
+                    "parameters": {
+                        "type": "object",
+                        "properties": param_properties,
+                        "required": param_required,
+                        "additionalProperties": False
+                    }
+                },
+                "required": ["function", "parameters"],
+                "additionalProperties": False
+            })
+            continue
+        
+        variants.append({
+            "type": "object",
+            "properties": {"function": function_schema, **param_properties},
+            "required": ["function"] + param_required,
+            "additionalProperties": False
+        })
+    
+    if len(variants) == 1:
+        return variants[0]
+    return {"anyOf": variants}
+
+
+def build_prompt(question: str, functions: List[Dict], catalog_format: str = "prose", catalog_token_budget: int = None,
+                 cache_tag: str = None) -> str:
+    """Build the Qwen chat prompt for a question and its candidate functions
     
-    # Format functions
-    functions_text = format_functions_for_prompt(functions)
+    cache_tag, if set, is written ahead of the system prompt so that runs being compared
+    never reuse each other's prefix-cache blocks.
+    """
+    functions_text = format_functions_for_prompt(functions, catalog_format, catalog_token_budget)
+    tag = f"[{cache_tag}]\n" if cache_tag else ""
     
     # Use Qwen chat template format (similar to ToolACE training)
-    prompt = f"""<|im_start|>system
+    return f"""{tag}<|im_start|>system
 You are a helpful assistant that can call functions. When asked to perform a task, respond with a JSON function call in this format:
 {{"function": "function_name", "param1": value1, "param2": value2}}
 
@@ -66,25 +254,45 @@ User request: {question}
 Respond with the function call in JSON format.<|im_end|>
 <|im_start|>assistant
 """
+
+
+def call_vllm_inference(question: str, functions: List[Dict], endpoint: str, model_name: str, guided_schema: Dict = None,
+                        catalog_format: str = "prose", catalog_token_budget: int = None, cache_tag: str = None) -> Dict:
+    """Call vLLM inference with proper formatting for Qwen model
+    
+    If guided_schema is given, decoding is constrained to it via vLLM's guided_json field.
+    """
+    prompt = build_prompt(question, functions, catalog_format, catalog_token_budget, cache_tag)
+    
+    payload = {
+        "model": model_name,
+        "prompt": prompt,
+        "max_tokens": 512,
+        "temperature": 0.0,
+        "stop": ["<|im_end|>", "<|endoftext|>", "\n\n\n"]
+    }
+    if guided_schema is not None:
+        payload["guided_json"] = guided_schema
     
+    start_time = time.time()
     try:
         response = requests.post(
             f"{endpoint}/v1/completions",
-            json={
-                "model": model_name,
-                "prompt": prompt,
-                "max_tokens": 512,
-                "temperature": 0.0,
-                "stop": ["<|im_end|>", "<|endoftext|>", "\n\n\n"]
-            },
+            json=payload,
             timeout=30
         )
+        latency = time.time() - start_time
         
         if response.status_code == 200:
             result = response.json()
+            usage = result.get("usage") or {}
             return {
                 "success": True,
-                "text": result["choices"][0]["text"].strip()
+                "text": result["choices"][0]["text"].strip(),
+                "finish_reason": result["choices"][0].get("finish_reason"),
+                "latency": latency,
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "completion_tokens": usage.get("completion_tokens")
             }
         else:
             return {
@@ -128,6 +336,15 @@ def extract_json_from_text(text: str) -> Dict:
     return {}
 
 
+def parse_guided_response(text: str) -> Dict:
+    """Parse a schema-constrained response; no regex recovery is needed"""
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
 def normalize_function_name(name: str) -> str:
     """Normalize function name for comparison"""
     return name.lower().replace('_', '').replace('.', '').replace('-', '')
@@ -186,8 +403,73 @@ def evaluate_response(predicted: Dict, expected_functions: List[Dict], question:
     return False, f"Wrong function. Expected one of: {expected_names}, got: {pred_func}", predicted
 
 
-def run_evaluation(dataset_path: str, endpoint: str, model_name: str, limit: int = 100, output_file: str = "results/bfcl_real_results.json"):
-    """Run complete BFCL evaluation"""
+def sample_category(sample_id: str) -> str:
+    """Derive the BFCL category from a sample id such as multiple_12"""
+    return sample_id.rsplit('_', 1)[0] if '_' in sample_id else sample_id
+
+
+def percentile(values: List[float], pct: int) -> float:
+    """Percentile helper that tolerates single-value lists"""
+    if not values:
+        return 0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+def summarize_telemetry(details: List[Dict]) -> Dict:
+    """Latency, token and truncation statistics for a set of answered samples"""
+    latencies = [d["latency"] for d in details]
+    prompt_tokens = [d["prompt_tokens"] for d in details if d["prompt_tokens"] is not None]
+    completion_tokens = [d["completion_tokens"] for d in details if d["completion_tokens"] is not None]
+    truncated = sum(1 for d in details if d["finish_reason"] == "length")
+    
+    return {
+        "samples": len(details),
+        "accuracy": sum(1 for d in details if d["correct"]) / len(details) if details else 0,
+        "latency_mean": statistics.mean(latencies) if latencies else 0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "prompt_tokens_mean": statistics.mean(prompt_tokens) if prompt_tokens else 0,
+        "completion_tokens_mean": statistics.mean(completion_tokens) if completion_tokens else 0,
+        "truncated_rate": truncated / len(details) if details else 0
+    }
+
+
+def group_telemetry(details: List[Dict], key: str) -> Dict:
+    """Summarize telemetry per distinct value of a detail field"""
+    groups = {}
+    for d in details:
+        groups.setdefault(str(d[key]), []).append(d)
+    return {group: summarize_telemetry(items) for group, items in sorted(groups.items())}
+
+
+def print_telemetry(telemetry: Dict):
+    """Print telemetry rollups and the slowest samples"""
+    for title, key in [("Category", "by_category"), ("Functions", "by_num_functions")]:
+        print(f"\n{title:<12} {'Samples':<9} {'Acc %':<8} {'P50 ms':<9} {'P95 ms':<9} {'Prompt tok':<11} {'Compl tok':<10} {'Trunc %':<8}")
+        for group, stats in telemetry[key].items():
+            print(f"{group:<12} {stats['samples']:<9} {stats['accuracy']*100:<8.1f} {stats['latency_p50']*1000:<9.0f} "
+                  f"{stats['latency_p95']*1000:<9.0f} {stats['prompt_tokens_mean']:<11.1f} "
+                  f"{stats['completion_tokens_mean']:<10.1f} {stats['truncated_rate']*100:<8.1f}")
+    
+    if telemetry["slowest"]:
+        print("\nSlowest samples:")
+        for d in telemetry["slowest"]:
+            print(f"  {d['id']:<16} {d['latency']*1000:>7.0f} ms  {d['num_functions']} functions  "
+                  f"{d['prompt_tokens']} prompt / {d['completion_tokens']} completion tokens  ({d['finish_reason']})")
+
+
+def run_evaluation(dataset_path: str, endpoint: str, model_name: str, limit: int = 100, output_file: str = "results/bfcl_real_results.json", decoding: str = "free",
+                   catalog_format: str = "prose", catalog_token_budget: int = None, top_slowest: int = 10,
+                   cache_tag: str = None):
+    """Run complete BFCL evaluation
+    
+    decoding is "free" (prompted JSON, parsed with fallbacks) or "guided" (schema-constrained JSON).
+    catalog_format / catalog_token_budget select how the function catalogue is written into the prompt.
+    top_slowest is how many of the slowest samples are listed in the telemetry rollup.
+    cache_tag keeps this run's prompts out of prefix-cache blocks filled by other runs (see build_prompt).
+    """
     
     print("\n" + "="*70)
     print("BFCL EVALUATION - REAL DATASET")
@@ -196,16 +478,22 @@ def run_evaluation(dataset_path: str, endpoint: str, model_name: str, limit: int
     print(f"Endpoint: {endpoint}")
     print(f"Model: {model_name}")
     print(f"Limit: {limit} samples")
+    print(f"Decoding: {decoding}")
+    print(f"Catalog format: {catalog_format}" + (f" (budget {catalog_token_budget} tokens)" if catalog_token_budget else ""))
     
     # Load data
     dataset = load_bfcl_dataset(dataset_path, limit)
     
     results = {
         "dataset": dataset_path,
+        "decoding": decoding,
+        "catalog_format": catalog_format,
+        "catalog_token_budget": catalog_token_budget,
         "total": len(dataset),
         "correct": 0,
         "incorrect": 0,
         "errors": 0,
+        "parse_failures": 0,
         "details": []
     }
     
@@ -234,7 +522,9 @@ def run_evaluation(dataset_path: str, endpoint: str, model_name: str, limit: int
             continue
         
         # Call model
-        response = call_vllm_inference(question, functions, endpoint, model_name)
+        guided_schema = build_guided_json_schema(functions) if decoding == "guided" else None
+        response = call_vllm_inference(question, functions, endpoint, model_name, guided_schema,
+                                       catalog_format, catalog_token_budget, cache_tag)
         
         if not response["success"]:
             print(f"✗ API Error")
@@ -248,7 +538,12 @@ def run_evaluation(dataset_path: str, endpoint: str, model_name: str, limit: int
             continue
         
         # Parse response
-        predicted = extract_json_from_text(response["text"])
+        if decoding == "guided":
+            predicted = parse_guided_response(response["text"])
+        else:
+            predicted = extract_json_from_text(response["text"])
+        if not predicted:
+            results["parse_failures"] += 1
         
         # Evaluate
         is_correct, message, parsed = evaluate_response(predicted, functions, question)
@@ -267,7 +562,13 @@ def run_evaluation(dataset_path: str, endpoint: str, model_name: str, limit: int
             "predicted_response": response["text"],
             "parsed": parsed,
             "correct": is_correct,
-            "message": message
+            "message": message,
+            "category": sample_category(sample.get('id', f'sample_{i}')),
+            "num_functions": len(functions),
+            "latency": response["latency"],
+            "prompt_tokens": response["prompt_tokens"],
+            "completion_tokens": response["completion_tokens"],
+            "finish_reason": response["finish_reason"]
         })
         
         # Rate limiting
@@ -276,6 +577,25 @@ def run_evaluation(dataset_path: str, endpoint: str, model_name: str, limit: int
     # Calculate metrics
     results["accuracy"] = results["correct"] / results["total"] if results["total"] > 0 else 0
     results["success_rate"] = (results["correct"] + results["incorrect"]) / results["total"] if results["total"] > 0 else 0
+    answered = results["correct"] + results["incorrect"]
+    results["parse_failure_rate"] = results["parse_failures"] / answered if answered > 0 else 0
+    answered_details = [d for d in results["details"] if "latency" in d]
+    overall = summarize_telemetry(answered_details)
+    results["latency_mean"] = overall["latency_mean"]
+    results["latency_p50"] = overall["latency_p50"]
+    results["latency_p95"] = overall["latency_p95"]
+    results["prompt_tokens_mean"] = overall["prompt_tokens_mean"]
+    results["completion_tokens_mean"] = overall["completion_tokens_mean"]
+    results["completion_tokens_total"] = sum(d["completion_tokens"] or 0 for d in answered_details)
+    results["truncated_rate"] = overall["truncated_rate"]
+    results["telemetry"] = {
+        "by_category": group_telemetry(answered_details, "category"),
+        "by_num_functions": group_telemetry(answered_details, "num_functions"),
+        "slowest": [
+            {k: d[k] for k in ("id", "category", "num_functions", "latency", "prompt_tokens", "completion_tokens", "finish_reason")}
+            for d in sorted(answered_details, key=lambda d: d["latency"], reverse=True)[:top_slowest]
+        ]
+    }
     
     # Save results
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
@@ -291,14 +611,46 @@ def run_evaluation(dataset_path: str, endpoint: str, model_name: str, limit: int
     print(f"Correct:          {results['correct']}")
     print(f"Incorrect:        {results['incorrect']}")
     print(f"Errors:           {results['errors']}")
+    print(f"Parse Failures:   {results['parse_failures']}")
     print(f"\n📊 Accuracy:      {results['accuracy']*100:.2f}%")
     print(f"✅ Success Rate:  {results['success_rate']*100:.2f}%")
+    print(f"⏱️  Latency:       mean {results['latency_mean']*1000:.0f} ms, "
+          f"p50 {results['latency_p50']*1000:.0f} ms, p95 {results['latency_p95']*1000:.0f} ms")
+    print(f"🔢 Mean Prompt Tokens: {results['prompt_tokens_mean']:.1f}")
+    print(f"🔢 Mean Completion Tokens: {results['completion_tokens_mean']:.1f}")
+    print(f"✂️  Truncated (max_tokens): {results['truncated_rate']*100:.1f}%")
+    print_telemetry(results["telemetry"])
     print("="*70)
     print(f"\n✓ Detailed results saved to: {output_file}")
     
     return results
 
 
+def compare_decoding_modes(free_results: Dict, guided_results: Dict) -> Dict:
+    """Summarize how guided decoding changes accuracy, tokens, latency and parse failures"""
+    metrics = ["accuracy", "parse_failure_rate", "latency_mean", "completion_tokens_mean", "completion_tokens_total"]
+    comparison = {
+        "dataset": free_results["dataset"],
+        "free": {m: free_results[m] for m in metrics},
+        "guided": {m: guided_results[m] for m in metrics},
+        "delta": {m: guided_results[m] - free_results[m] for m in metrics}
+    }
+    
+    print("\n" + "="*70)
+    print("DECODING MODE COMPARISON")
+    print("="*70)
+    print(f"{'Metric':<26} {'Free':<14} {'Guided':<14} {'Delta':<14}")
+    print("-"*70)
+    print(f"{'Accuracy':<26} {comparison['free']['accuracy']*100:<14.2f} {comparison['guided']['accuracy']*100:<14.2f} {comparison['delta']['accuracy']*100:<+14.2f}")
+    print(f"{'Parse failure rate (%)':<26} {comparison['free']['parse_failure_rate']*100:<14.2f} {comparison['guided']['parse_failure_rate']*100:<14.2f} {comparison['delta']['parse_failure_rate']*100:<+14.2f}")
+    print(f"{'Mean latency (ms)':<26} {comparison['free']['latency_mean']*1000:<14.0f} {comparison['guided']['latency_mean']*1000:<14.0f} {comparison['delta']['latency_mean']*1000:<+14.0f}")
+    print(f"{'Mean completion tokens':<26} {comparison['free']['completion_tokens_mean']:<14.1f} {comparison['guided']['completion_tokens_mean']:<14.1f} {comparison['delta']['completion_tokens_mean']:<+14.1f}")
+    print(f"{'Total completion tokens':<26} {comparison['free']['completion_tokens_total']:<14} {comparison['guided']['completion_tokens_total']:<14} {comparison['delta']['completion_tokens_total']:<+14}")
+    print("="*70)
+    
+    return comparison
+
+
 def main():
     parser = argparse.ArgumentParser(description="Run BFCL evaluation on real dataset")
     parser.add_argument("--dataset", default="data/bfcl_simple_parsed.json", help="Path to BFCL dataset")
@@ -306,6 +658,13 @@ def main():
     parser.add_argument("--model", default="/models/merged-qwen25-7b-finetuned", help="Model name/path")
     parser.add_argument("--limit", type=int, default=100, help="Number of samples")
     parser.add_argument("--output", default="results/bfcl_real_results.json", help="Output file")
+    parser.add_argument("--decoding", default="free", choices=["free", "guided", "both"],
+                        help="Free-form JSON, schema-guided JSON (vLLM guided_json), or both side by side")
+    parser.add_argument("--catalog-format", default="prose", choices=sorted(CATALOG_FORMATTERS),
+                        help="How the function catalogue is written into the prompt")
+    parser.add_argument("--catalog-token-budget", type=int, default=None,
+                        help="Truncate descriptions until the catalogue fits this many (estimated) tokens")
+    parser.add_argument("--top-slowest", type=int, default=10, help="Number of slowest samples to list")
     
     args = parser.parse_args()
     
@@ -314,7 +673,27 @@ def main():
         print("Please run the download script first")
         sys.exit(1)
     
-    run_evaluation(args.dataset, args.endpoint, args.model, args.limit, args.output)
+    if args.decoding != "both":
+        run_evaluation(args.dataset, args.endpoint, args.model, args.limit, args.output, args.decoding,
+                       args.catalog_format, args.catalog_token_budget, args.top_slowest)
+        return
+    
+    # Per-mode tags stop the guided pass from reusing prefill cached by the free pass
+    # (vLLM runs with --enable-prefix-caching), which would flatter its latency
+    base, ext = os.path.splitext(args.output)
+    run_nonce = random.randint(0, 10**6)
+    free_results = run_evaluation(args.dataset, args.endpoint, args.model, args.limit, f"{base}_free{ext}", "free",
+                                  args.catalog_format, args.catalog_token_budget, args.top_slowest,
+                                  cache_tag=f"free {run_nonce}")
+    guided_results = run_evaluation(args.dataset, args.endpoint, args.model, args.limit, f"{base}_guided{ext}", "guided",
+                                    args.catalog_format, args.catalog_token_budget, args.top_slowest,
+                                    cache_tag=f"guided {run_nonce}")
+    comparison = compare_decoding_modes(free_results, guided_results)
+    
+    comparison_file = f"{base}_decoding_comparison{ext}"
+    with open(comparison_file, 'w') as f:
+        json.dump(comparison, f, indent=2)
+    print(f"\n✓ Decoding comparison saved to: {comparison_file}")
 
 
 if __name__ == "__main__":
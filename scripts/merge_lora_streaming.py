@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Streaming CPU LoRA Merge
+Merges a PEFT LoRA/DoRA adapter into a safetensors base model one tensor at a time:
+each base tensor is read from its memory-mapped shard, the LoRA delta (B·A·scale)
+is applied on CPU, and the result is streamed into an output shard whose header is
+written up front. Peak memory is roughly the largest single tensor, no GPU is needed,
+and the output keeps the base model's shard layout plus a vLLM-loadable index.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import shutil
+import struct
+import argparse
+from typing import Dict, Iterator, List, Tuple
+
+import torch
+from safetensors import safe_open
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+DTYPE_SIZES = {"F64": 8, "F32": 4, "F16": 2, "BF16": 2, "I64": 8, "I32": 4, "I16": 2, "I8": 1, "U8": 1, "BOOL": 1}
+
+# Base-model files that are never copied to the output (weights are rewritten)
+WEIGHT_FILE_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth", ".safetensors.index.json", ".bin.index.json")
+
+ADAPTER_PREFIX = "base_model.model."
+
+
+def resolve_base_model(base_model: str, cache_dir: str = None) -> str:
+    """Return a local directory for the base model, downloading safetensors from the Hub only if needed"""
+    if os.path.isdir(base_model):
+        return base_model
+
+    try:
+        from huggingface_hub import snapshot_download
+    except ImportError:
+        print("✗ huggingface_hub is required to download the base model; pass a local directory instead")
+        sys.exit(1)
+
+    print(f"Resolving base model from Hugging Face (cache: {cache_dir or 'default'})...")
+    return snapshot_download(
+        base_model,
+        cache_dir=cache_dir,
+        allow_patterns=["*.safetensors", "*.json", "*.txt", "*.model", "*.tiktoken"]
+    )
+
+
+def read_safetensors_header(path: str) -> Dict:
+    """Read a safetensors header (tensor name -> dtype, shape, data_offsets) without loading data"""
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+    return header
+
+
+def write_streaming_shard(path: str, entries: List[Tuple[str, str, List[int]]], tensors: Iterator[torch.Tensor]):
+    """
+    Write a safetensors file from (name, dtype, shape) entries and a tensor iterator
+    Offsets are computed from the entries, so the header is written before any data
+    and only one tensor is held in memory at a time.
+    """
+    header = {"__metadata__": {"format": "pt"}}
+    offset = 0
+    for name, dtype, shape in entries:
+        nbytes = math.prod(shape) * DTYPE_SIZES[dtype]
+        header[name] = {"dtype": dtype, "shape": shape, "data_offsets": [offset, offset + nbytes]}
+        offset += nbytes
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    # Data must start on an 8-byte boundary; pad the header with spaces
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for (name, _, _), tensor in zip(entries, tensors):
+            data = tensor.contiguous().reshape(-1).view(torch.uint8).numpy()
+            expected = header[name]["data_offsets"][1] - header[name]["data_offsets"][0]
+            if data.nbytes != expected:
+                raise ValueError(f"{name}: expected {expected} bytes, got {data.nbytes}")
+            f.write(data)
+
+
+def pattern_value(module_name: str, patterns: Dict, default):
+    """Look up a PEFT rank_pattern/alpha_pattern entry for a module"""
+    for key, value in (patterns or {}).items():
+        if re.match(rf"(.*\.)?{key}$", module_name):
+            return value
+    return default
+
+
+class LoraAdapter:
+    """Lazy view of a PEFT adapter: maps base weight names to their LoRA tensors and scale"""
+
+    def __init__(self, adapter_dir: str):
+        with open(os.path.join(adapter_dir, "adapter_config.json")) as f:
+            self.config = json.load(f)
+
+        path = os.path.join(adapter_dir, "adapter_model.safetensors")
+        if not os.path.exists(path):
+            print(f"✗ {path} not found (only safetensors adapters are supported)")
+            sys.exit(1)
+        self.handle = safe_open(path, framework="pt", device="cpu")
+
+        self.lora: Dict[str, Dict[str, str]] = {}
+        self.replacements: Dict[str, str] = {}
+        for key in self.handle.keys():
+            name = key[len(ADAPTER_PREFIX):] if key.startswith(ADAPTER_PREFIX) else key
+            if "lora_embedding_" in name:
+                raise ValueError(f"Embedding LoRA is not supported: {key}")
+
+            match = re.match(r"(.+)\.(lora_A|lora_B|lora_magnitude_vector)(\.weight)?$", name)
+            if match:
+                self.lora.setdefault(f"{match.group(1)}.weight", {})[match.group(2)] = key
+            else:
+                # modules_to_save: full replacement tensors
+                self.replacements[name] = key
+
+    def scale(self, base_key: str, rank: int) -> float:
+        module = base_key[:-len(".weight")]
+        alpha = pattern_value(module, self.config.get("alpha_pattern"), self.config.get("lora_alpha", rank))
+        return alpha / math.sqrt(rank) if self.config.get("use_rslora") else alpha / rank
+
+    def merge(self, base_key: str, weight: torch.Tensor) -> torch.Tensor:
+        """Return weight with the LoRA (or DoRA) update for base_key applied"""
+        parts = self.lora[base_key]
+        lora_a = self.handle.get_tensor(parts["lora_A"]).float()
+        lora_b = self.handle.get_tensor(parts["lora_B"]).float()
+        delta = (lora_b @ lora_a) * self.scale(base_key, lora_a.shape[0])
+        if self.config.get("fan_in_fan_out"):
+            delta = delta.T
+
+        merged = weight.float() + delta
+        if "lora_magnitude_vector" in parts:
+            # DoRA: rescale each output row to the learned magnitude
+            magnitude = self.handle.get_tensor(parts["lora_magnitude_vector"]).float().reshape(-1)
+            oriented = merged.T if self.config.get("fan_in_fan_out") else merged
+            norm = torch.linalg.norm(oriented, dim=1)
+            oriented = oriented * (magnitude / norm).unsqueeze(1)
+            merged = oriented.T if self.config.get("fan_in_fan_out") else oriented
+
+        return merged.to(weight.dtype)
+
+
+def merge_model(base_dir: str, adapter_dir: str, output_dir: str) -> Dict:
+    """Stream every base shard through the adapter into output_dir; returns merge statistics"""
+    adapter = LoraAdapter(adapter_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    shards = sorted(f for f in os.listdir(base_dir) if f.endswith(".safetensors"))
+    if not shards:
+        print(f"✗ No safetensors shards found in {base_dir}")
+        sys.exit(1)
+
+    weight_map = {}
+    total_size = 0
+    merged_keys = set()
+    replaced_keys = set()
+
+    for shard in shards:
+        shard_start = time.time()
+        header = read_safetensors_header(os.path.join(base_dir, shard))
+        entries = [(name, info["dtype"], info["shape"]) for name, info in
+                   sorted(header.items(), key=lambda item: item[1]["data_offsets"][0])]
+
+        def tensors() -> Iterator[torch.Tensor]:
+            with safe_open(os.path.join(base_dir, shard), framework="pt", device="cpu") as base:
+                for name, dtype, shape in entries:
+                    if name in adapter.replacements:
+                        replaced_keys.add(name)
+                        tensor = adapter.handle.get_tensor(adapter.replacements[name]).to(SAFETENSORS_DTYPES[dtype])
+                        if list(tensor.shape) != shape:
+                            raise ValueError(f"{name}: adapter shape {list(tensor.shape)} != base shape {shape}")
+                        yield tensor
+                    elif name in adapter.lora:
+                        merged_keys.add(name)
+                        yield adapter.merge(name, base.get_tensor(name))
+                    else:
+                        yield base.get_tensor(name)
+
+        write_streaming_shard(os.path.join(output_dir, shard), entries, tensors())
+
+        for name, info in header.items():
+            weight_map[name] = shard
+            total_size += info["data_offsets"][1] - info["data_offsets"][0]
+        print(f"✓ {shard}: {len(entries)} tensors in {time.time() - shard_start:.1f}s")
+
+    unmatched = (set(adapter.lora) - merged_keys) | (set(adapter.replacements) - replaced_keys)
+    if unmatched:
+        raise ValueError(f"Adapter tensors with no matching base weight: {sorted(unmatched)[:5]}...")
+
+    with open(os.path.join(output_dir, "model.safetensors.index.json"), "w") as f:
+        json.dump({"metadata": {"total_size": total_size}, "weight_map": dict(sorted(weight_map.items()))}, f, indent=2)
+
+    # Config, generation config and tokenizer files come from the base model
+    for name in os.listdir(base_dir):
+        src = os.path.join(base_dir, name)
+        if os.path.isfile(src) and not name.endswith(WEIGHT_FILE_SUFFIXES):
+            shutil.copy(src, os.path.join(output_dir, name))
+
+    return {"shards": len(shards), "merged": len(merged_keys), "replaced": len(replaced_keys), "total_size": total_size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge a LoRA adapter into a safetensors base model on CPU")
+    parser.add_argument("--base-model", required=True, help="Local model directory or Hugging Face repo id")
+    parser.add_argument("--adapter", required=True, help="PEFT adapter directory (adapter_config.json + safetensors)")
+    parser.add_argument("--output", required=True, help="Output directory for the merged model")
+    parser.add_argument("--cache-dir", default=os.getenv("HF_HOME"),
+                        help="Hugging Face cache (put it on shared storage to avoid re-downloading)")
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads for torch matmuls")
+
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    print("="*60)
+    print("Streaming CPU LoRA Merge")
+    print("="*60)
+    print(f"Base model: {args.base_model}")
+    print(f"Adapter:    {args.adapter}")
+    print(f"Output:     {args.output}")
+
+    start_time = time.time()
+    base_dir = resolve_base_model(args.base_model, args.cache_dir)
+    stats = merge_model(base_dir, args.adapter, args.output)
+
+    print(f"\n{'='*60}")
+    print(f"✓ Merged {stats['merged']} LoRA weights, replaced {stats['replaced']} modules_to_save tensors")
+    print(f"✓ Wrote {stats['shards']} shards ({stats['total_size'] / 1e9:.2f} GB) in {time.time() - start_time:.0f}s")
+    print(f"✓ Merged model saved to: {args.output}")
+    print(f"{'='*60}")
+
+
+if __name__ == "__main__":
+    main()
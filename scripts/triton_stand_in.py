@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Local Triton Stand-in
+A small HTTP server that speaks the subset of Triton's v2 API used by the benchmark
+and autotuning scripts (health, model config, explicit model-control load/unload and
+infer). Requests go through a simulated dynamic batcher that honours the loaded
+config's max_batch_size, preferred_batch_size and max_queue_delay_microseconds, and
+batches execute on one simulated instance with latency base + per-item cost.
+"""
+
+import re
+import json
+import time
+import copy
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# JSON form of the config.pbtxt in kubernetes/triton-inference-deployment.yaml
+DEFAULT_CONFIG = {
+    "name": "qwen-function-calling",
+    "backend": "vllm",
+    "max_batch_size": 32,
+    "input": [
+        {"name": "text_input", "data_type": "TYPE_STRING", "dims": [-1]},
+        {"name": "max_tokens", "data_type": "TYPE_INT32", "dims": [1], "optional": True}
+    ],
+    "output": [
+        {"name": "text_output", "data_type": "TYPE_STRING", "dims": [-1]}
+    ],
+    "instance_group": [
+        {"count": 1, "kind": "KIND_GPU", "gpus": [0]}
+    ],
+    "dynamic_batching": {
+        "preferred_batch_size": [8, 16, 32],
+        "max_queue_delay_microseconds": 100000
+    }
+}
+
+
+# Model config data types and their v2 protocol datatype names
+DATATYPES = {"TYPE_STRING": "BYTES", "TYPE_INT32": "INT32", "TYPE_INT64": "INT64", "TYPE_FP32": "FP32",
+             "TYPE_BOOL": "BOOL"}
+
+
+def validate_inputs(config: Dict, inputs: List[Dict]) -> Optional[str]:
+    """Check request inputs against the model config the way Triton does; returns an error or None"""
+    declared = {i["name"]: i for i in config.get("input", [])}
+    batched = int(config.get("max_batch_size", 0)) > 0
+    for tensor in inputs:
+        spec = declared.get(tensor.get("name"))
+        if spec is None:
+            return f"unexpected inference input '{tensor.get('name')}' for model '{config['name']}'"
+        expected_type = DATATYPES.get(spec.get("data_type"), spec.get("data_type"))
+        if tensor.get("datatype") != expected_type:
+            return (f"inference input '{spec['name']}' data-type is '{tensor.get('datatype')}', "
+                    f"but model '{config['name']}' expects '{expected_type}'")
+        # Batched models take a leading batch dimension ahead of the configured dims
+        expected_rank = len(spec.get("dims", [])) + (1 if batched else 0)
+        if len(tensor.get("shape", [])) != expected_rank:
+            return (f"unexpected shape for input '{spec['name']}' for model '{config['name']}'. "
+                    f"Expected rank {expected_rank}, got {tensor.get('shape')}")
+
+    provided = {t.get("name") for t in inputs}
+    missing = [name for name, spec in declared.items() if not spec.get("optional") and name not in provided]
+    if missing:
+        return f"expected inputs {missing} were not provided for model '{config['name']}'"
+    return None
+
+
+class PendingRequest:
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.arrival = time.time()
+        self.done = threading.Event()
+        self.batch_size = 0
+
+
+class SimulatedModel:
+    """One loaded model: a request queue drained by a dynamic-batching scheduler thread"""
+
+    def __init__(self, config: Dict, base_latency_ms: float, per_item_ms: float):
+        self.config = config
+        self.base_latency = base_latency_ms / 1000
+        self.per_item = per_item_ms / 1000
+        self.queue: List[PendingRequest] = []
+        self.cond = threading.Condition()
+        self.running = True
+        threading.Thread(target=self._scheduler, daemon=True).start()
+
+    def _batch_limits(self):
+        max_batch_size = max(int(self.config.get("max_batch_size", 0)), 1)
+        batching = self.config.get("dynamic_batching")
+        if batching is None:
+            # No dynamic batcher: Triton runs requests one at a time
+            return 1, 1, 0.0
+        preferred = [int(b) for b in batching.get("preferred_batch_size", []) if int(b) <= max_batch_size]
+        target = max(preferred) if preferred else max_batch_size
+        delay = int(batching.get("max_queue_delay_microseconds", 0)) / 1e6
+        return max_batch_size, target, delay
+
+    def _scheduler(self):
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.running:
+                    return
+
+                max_batch_size, target, delay = self._batch_limits()
+                # Hold the batch open until it reaches the target size or the oldest request times out
+                deadline = self.queue[0].arrival + delay
+                while self.running and len(self.queue) < target and time.time() < deadline:
+                    self.cond.wait(deadline - time.time())
+                if not self.running:
+                    return
+
+                batch = self.queue[:max_batch_size]
+                del self.queue[:len(batch)]
+
+            time.sleep(self.base_latency + self.per_item * len(batch))
+            for request in batch:
+                request.batch_size = len(batch)
+                request.done.set()
+
+    def infer(self, prompt: str) -> PendingRequest:
+        request = PendingRequest(prompt)
+        with self.cond:
+            self.queue.append(request)
+            self.cond.notify_all()
+        request.done.wait()
+        return request
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            # Release anything still queued so handler threads don't hang
+            for request in self.queue:
+                request.done.set()
+            self.queue.clear()
+            self.cond.notify_all()
+
+
+class StandInState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.repository = {args.model: copy.deepcopy(DEFAULT_CONFIG)}
+        self.repository[args.model]["name"] = args.model
+        self.models: Dict[str, SimulatedModel] = {}
+        if not args.no_preload:
+            self.load(args.model)
+
+    def load(self, name: str, override: Optional[Dict] = None):
+        if name not in self.repository:
+            raise KeyError(f"failed to load '{name}', no version is available")
+        config = copy.deepcopy(override) if override is not None else copy.deepcopy(self.repository[name])
+        config["name"] = name
+        time.sleep(self.args.load_delay)
+        with self.lock:
+            if name in self.models:
+                self.models[name].stop()
+            self.models[name] = SimulatedModel(config, self.args.base_latency_ms, self.args.per_item_ms)
+
+    def unload(self, name: str):
+        with self.lock:
+            model = self.models.pop(name, None)
+        if model:
+            model.stop()
+
+
+def make_handler(state: StandInState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            if state.args.verbose:
+                super().log_message(format, *args)
+
+        def _send(self, status: int, body: Optional[Dict] = None):
+            data = json.dumps(body if body is not None else {}).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> Dict:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length)) if length else {}
+
+        def do_GET(self):
+            if self.path in ("/v2/health/ready", "/v2/health/live"):
+                return self._send(200)
+
+            match = re.fullmatch(r"/v2/models/([^/]+)(/ready|/config)?", self.path)
+            if not match:
+                return self._send(404, {"error": "not found"})
+            model = state.models.get(match.group(1))
+            if model is None:
+                return self._send(400, {"error": f"Request for unknown model: '{match.group(1)}' is not found"})
+            if match.group(2) == "/ready":
+                return self._send(200)
+            if match.group(2) == "/config":
+                return self._send(200, model.config)
+            return self._send(200, {"name": match.group(1), "versions": ["1"], "platform": "vllm"})
+
+        def do_POST(self):
+            match = re.fullmatch(r"/v2/repository/models/([^/]+)/(load|unload)", self.path)
+            if match:
+                name, action = match.groups()
+                body = self._body()
+                try:
+                    if action == "unload":
+                        state.unload(name)
+                    else:
+                        config = body.get("parameters", {}).get("config")
+                        state.load(name, json.loads(config) if config else None)
+                except (KeyError, ValueError) as e:
+                    return self._send(400, {"error": str(e)})
+                return self._send(200)
+
+            match = re.fullmatch(r"/v2/models/([^/]+)/infer", self.path)
+            if not match:
+                return self._send(404, {"error": "not found"})
+            model = state.models.get(match.group(1))
+            if model is None:
+                return self._send(400, {"error": f"Request for unknown model: '{match.group(1)}' is not found"})
+
+            tensors = self._body().get("inputs", [])
+            error = validate_inputs(model.config, tensors)
+            if error:
+                return self._send(400, {"error": error})
+
+            inputs = {t["name"]: t.get("data", [None])[0] for t in tensors}
+            prompt = inputs.get("text_input") or ""
+            request = model.infer(prompt)
+            text = f"[stand-in batch={request.batch_size}] {prompt}"
+            return self._send(200, {
+                "model_name": match.group(1),
+                "outputs": [{"name": "text_output", "datatype": "BYTES", "shape": [1], "data": [text]}]
+            })
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Triton stand-in with simulated dynamic batching")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address")
+    parser.add_argument("--port", type=int, default=8000, help="HTTP port")
+    parser.add_argument("--model", default="qwen-function-calling", help="Model name in the simulated repository")
+    parser.add_argument("--base_latency_ms", type=float, default=40, help="Fixed execution time per batch")
+    parser.add_argument("--per_item_ms", type=float, default=4, help="Extra execution time per request in a batch")
+    parser.add_argument("--load_delay", type=float, default=0.5, help="Seconds a model load takes")
+    parser.add_argument("--no_preload", action="store_true", help="Start with the model unloaded (explicit mode)")
+    parser.add_argument("--verbose", action="store_true", help="Log every HTTP request")
+
+    args = parser.parse_args()
+
+    state = StandInState(args)
+    # The default listen backlog (5) drops connects under benchmark concurrency
+    ThreadingHTTPServer.request_queue_size = 256
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+
+    print("="*60)
+    print("Triton Stand-in")
+    print("="*60)
+    print(f"URL:          http://{args.host}:{args.port}")
+    print(f"Model:        {args.model} ({'unloaded' if args.no_preload else 'loaded'})")
+    print(f"Batch cost:   {args.base_latency_ms:.0f}ms + {args.per_item_ms:.0f}ms/request")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()